@@ -0,0 +1,15 @@
+# __main__.py
+#!/usr/bin/python
+""" Entry point of python -m gcode, see cli.py """
+import os
+import sys
+
+# modules of package import each other by plain names, so "gcode" must
+# be gcode.py, not this package
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.modules.pop('gcode', None)
+
+from cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
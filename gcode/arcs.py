@@ -0,0 +1,111 @@
+# arcs.py
+#!/usr/bin/python
+import numpy as np
+
+
+TOLERANCE = 0.01   # mm, maximal distance between arc and its chords
+
+
+def centers(start, end, offsets, radius, clockwise):
+    """
+    Return centers of arcs.
+
+    Parameters
+    ----------
+    start, end : arrays of dtype float, shape (n, 2)
+        X, Y of the beginning and of the end of every arc.
+    offsets : array of dtype float, shape (n, 2)
+        I, J (center minus start), NaN if arc is given by radius.
+    radius : array of dtype float, shape (n,)
+        R, negative for arcs more than half of circle; used only where
+        I and J are both NaN.
+    clockwise : array of dtype bool, shape (n,)
+        G2 arcs.
+    """
+    center = start + np.nan_to_num(offsets)
+    by_radius = np.isnan(offsets).all(axis=1)
+    if by_radius.any():
+        a, b = start[by_radius], end[by_radius]
+        r = radius[by_radius]
+        chord = b - a
+        half = np.sqrt((chord**2).sum(axis=1)) / 2
+        h = np.sqrt(np.maximum(r**2 - half**2, 0))
+        # center is on the right of chord for clockwise arcs less than
+        # half of circle, on the left for counterclockwise ones
+        side = np.where(clockwise[by_radius], 1., -1.) * np.sign(r)
+        normal = np.column_stack((chord[:, 1], -chord[:, 0]))
+        normal /= np.maximum(2 * half, 1e-12)[:, None]
+        center[by_radius] = (a + b) / 2 + (side * h)[:, None] * normal
+    return center
+
+
+def sweeps(start, end, center, clockwise):
+    """
+    Return radius, start angle and signed sweep angle of every arc.
+
+    Sweep is negative for clockwise arcs, arc with the same beginning
+    and end is a full circle. Arguments are like in tessellate.
+    """
+    a = start[:, :2] - center
+    b = end[:, :2] - center
+    r = np.sqrt((a**2).sum(axis=1))
+    angle0 = np.arctan2(a[:, 1], a[:, 0])
+    sweep = np.arctan2(b[:, 1], b[:, 0]) - angle0
+    sweep = np.where(clockwise, -(-sweep % (2 * np.pi)), sweep % (2 * np.pi))
+    full = np.isclose(sweep, 0)
+    sweep[full] = np.where(clockwise[full], -2 * np.pi, 2 * np.pi)
+    return r, angle0, sweep
+
+
+def lengths(start, end, center, clockwise):
+    """ Return lengths of arcs (helixes, if Z changes) """
+    r, angle0, sweep = sweeps(start, end, center, clockwise)
+    return np.hypot(r * sweep, end[:, 2] - start[:, 2])
+
+
+def tessellate(start, end, center, clockwise, tolerance=TOLERANCE):
+    """
+    Split arcs into chords.
+
+    Parameters
+    ----------
+    start, end : arrays of dtype float, shape (n, 3)
+        X, Y, Z of the beginning and of the end of every arc; Z changes
+        linearly (helix).
+    center : array of dtype float, shape (n, 2)
+        X, Y of centers.
+    clockwise : array of dtype bool, shape (n,)
+        G2 arcs.
+    tolerance : float
+        Maximal distance between arc and chords; number of chords of
+        every arc is the least one, which gives it.
+
+    Returns
+    -------
+    counts : array of dtype int, shape (n,)
+        Number of chords of every arc.
+    points : array of dtype float, shape (counts.sum(), 3)
+        Ends of chords, the last one of every arc is its end.
+
+    Notes
+    -----
+    Arc with the same beginning and end is a full circle.
+    """
+    r, angle0, sweep = sweeps(start, end, center, clockwise)
+
+    # chord with angle t is far from arc by r * (1 - cos(t/2))
+    cos = np.clip(1 - tolerance / np.maximum(r, 1e-12), -1, 1)
+    step = 2 * np.arccos(cos)
+    counts = np.maximum(np.ceil(np.abs(sweep) / np.maximum(step, 1e-9)),
+                        1).astype(int)
+
+    arc = np.repeat(np.arange(len(counts)), counts)
+    first = np.cumsum(counts) - counts
+    t = (np.arange(len(arc)) - first[arc] + 1) / counts[arc].astype(float)
+    angle = angle0[arc] + sweep[arc] * t
+    points = np.empty((len(arc), 3))
+    points[:, 0] = center[arc, 0] + r[arc] * np.cos(angle)
+    points[:, 1] = center[arc, 1] + r[arc] * np.sin(angle)
+    points[:, 2] = start[arc, 2] + (end[arc, 2] - start[arc, 2]) * t
+    points[first + counts - 1] = end
+    return counts, points
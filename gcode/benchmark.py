@@ -0,0 +1,202 @@
+# benchmark.py
+#!/usr/bin/python
+"""
+Benchmarks of hot paths over gcodes/ and synthetic files.
+
+Usage: python benchmark.py [-o results.json] [--compare old.json]
+
+Every benchmark is run {repeat} times on every file, the best and the
+median time are written as JSON with commit and versions, so results of
+two commits can be compared: --compare prints ratios and exits with 1,
+if some benchmark is slower than threshold.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import gcode
+import lod
+import synthetic
+from cli import count_lines
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FILES = ['gcodes/gcode.gcode', 'gcodes/altair.gcode',
+         'gcodes/test_export.gcode']
+SIZES = [10000, 100000]   # lines of synthetic files by default
+THRESHOLD = 0.2   # slower by 20% is regression
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def validate(path):
+    g = gcode.gcode.from_file(path)
+
+    def run():
+        if not g.check():
+            raise gcode.GcodeError('Invalid g-codes')
+    return run
+
+
+def parse(path):
+    g = gcode.gcode.from_file(path)
+    return lambda: len(g.move_array())
+
+
+def fill(path):
+    g = gcode.gcode.from_file(path)
+    moves = g.move_array()
+    return lambda: len(g.fill_moves(moves.copy())[0])
+
+
+def estimate(path):
+    g = gcode.gcode.from_file(path)
+    moves = g.move_array()
+    return lambda: len(g.estimate(moves=moves))
+
+
+def color(path):
+    g = gcode.gcode.from_file(path)
+    coords, lines = g.fill_moves()
+    return lambda: len(g.line_colors(coords)[0])
+
+
+def get_dots(path):
+    g = gcode.gcode.from_file(path)
+    return lambda: len(g.get_dots())
+
+
+def get_data(path):
+    g = gcode.gcode.from_file(path)
+    return lambda: len(g.get_data()[0])
+
+
+def render_prep(path):
+    """ Everything for show_image before OpenGL: LOD and layers """
+    toolpath = gcode.gcode.from_file(path).get_toolpath()
+
+    def run():
+        positions = np.ascontiguousarray(toolpath.positions)
+        levels = lod.levels(positions)
+        toolpath._layers = None
+        return len(levels[-1][1]) + len(toolpath.layers)
+    return run
+
+
+BENCHMARKS = [('validate', validate), ('parse', parse), ('fill', fill),
+              ('estimate', estimate), ('color', color), ('get_dots', get_dots),
+              ('get_data', get_data), ('render_prep', render_prep)]
+
+
+def synthetic_file(lines, seed=0):
+    """ Return path of synthetic file, it's generated once """
+    path = os.path.join(tempfile.gettempdir(),
+                        'gcode-bench-{}-{}.gcode'.format(lines, seed))
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'w') as f:
+            synthetic.generate(lines, f, seed)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def measure(setup, path, repeat):
+    """ Return (times, points) of benchmark on file """
+    run = setup(path)
+    times = []
+    for i in range(repeat):
+        start = clock()
+        points = run()
+        times.append(clock() - start)
+    return times, points
+
+
+def meta():
+    """ Return commit and versions, which results depend on """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(files, names, repeat):
+    results = []
+    for path in files:
+        lines = count_lines(path)
+        for name, setup in BENCHMARKS:
+            if names and name not in names:
+                continue
+            times, points = measure(setup, path, repeat)
+            times.sort()
+            result = {'benchmark': name,
+                      'file': os.path.relpath(path, HERE)
+                      if path.startswith(HERE) else os.path.basename(path),
+                      'lines': lines, 'points': points, 'repeat': repeat,
+                      'best': times[0], 'median': times[len(times) // 2]}
+            sys.stderr.write(
+                '{benchmark:<12} {file:<28} {best:10.4f}\n'.format(**result))
+            results.append(result)
+    return results
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """ Print ratios of best times, return list of regressions """
+    before = dict(((r['benchmark'], r['file']), r['best'])
+                  for r in old['results'])
+    slower = []
+    print('{:<12} {:<28} {:>10} {:>10} {:>7}'.format(
+        'benchmark', 'file', 'old', 'new', 'ratio'))
+    for r in new['results']:
+        key = (r['benchmark'], r['file'])
+        if key not in before:
+            continue
+        ratio = r['best'] / before[key] if before[key] else float('inf')
+        mark = ''
+        if ratio > 1 + threshold:
+            slower.append(key)
+            mark = ' slower'
+        print('{:<12} {:<28} {:10.4f} {:10.4f} {:7.2f}{}'.format(
+            key[0], key[1], before[key], r['best'], ratio, mark))
+    return slower
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='Benchmark gcode hot paths.')
+    p.add_argument('files', nargs='*',
+                   help='gcode files (default: {})'.format(', '.join(FILES)))
+    p.add_argument('-s', '--synthetic', type=int, nargs='*', default=SIZES,
+                   help='lines of synthetic files (default: {})'.format(
+                       ' '.join(map(str, SIZES))))
+    p.add_argument('-b', '--benchmark', action='append',
+                   choices=[name for name, setup in BENCHMARKS],
+                   help='run only this benchmark (may be repeated)')
+    p.add_argument('-r', '--repeat', type=int, default=3)
+    p.add_argument('-o', '--output', default=None,
+                   help='file of JSON results (default: stdout)')
+    p.add_argument('--compare', default=None,
+                   help='JSON results of other run to compare with')
+    p.add_argument('--threshold', type=float, default=THRESHOLD,
+                   help='relative slowdown, which is regression')
+    args = p.parse_args()
+
+    files = args.files or [os.path.join(HERE, f) for f in FILES]
+    files += [synthetic_file(n) for n in args.synthetic]
+    results = {'meta': meta(),
+               'results': run(files, args.benchmark, args.repeat)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(1 if compare(json.load(f), results, args.threshold)
+                     else 0)
@@ -0,0 +1,99 @@
+# cache.py
+#!/usr/bin/python
+import os
+import logging
+import hashlib
+import tempfile
+from toolpath import Toolpath
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gcode')
+CACHE_SIZE = 512 * 1024 * 1024   # bytes
+VERSION = 4   # change it, if format of toolpath is changed
+replace = getattr(os, 'replace', os.rename)   # python 2 has rename only
+
+
+class Cache(object):
+    """
+    Persistent cache of toolpaths, one toolpath file (.gtp) per toolpath
+
+    Attributes
+    ----------
+    key : string
+        Return key of content hash and parse settings.
+    get : Toolpath
+        Return cached toolpath or None.
+    put : None
+        Save toolpath and remove least recently used files.
+
+    Parameters
+    ----------
+    path : string
+        Directory of cache.
+    size : int
+        Maximal size of cache in bytes.
+    """
+    def __init__(self, path=CACHE_DIR, size=CACHE_SIZE):
+        self.path = path
+        self.size = size
+
+    def key(self, digest, settings):
+        """ Return key of content hash and parse settings """
+        h = hashlib.sha1(digest.encode('ascii'))
+        h.update(repr((VERSION, settings)).encode('ascii'))
+        return h.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + '.gtp')
+
+    def get(self, key):
+        """ Return cached toolpath or None """
+        fl = self.filename(key)
+        try:
+            toolpath = Toolpath.load(fl)
+        except (IOError, OSError, ValueError):
+            return None
+        log.debug('Toolpath from cache: {}'.format(fl))
+        os.utime(fl, None)   # recently used
+        return toolpath
+
+    def put(self, key, toolpath):
+        """ Save toolpath and remove least recently used files """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fl = self.filename(key)
+        # unique temporary file: other processes may save the same key
+        handle, temp = tempfile.mkstemp('.tmp', key, self.path)
+        os.close(handle)
+        try:
+            toolpath.save(temp)
+            replace(temp, fl)
+        except BaseException:
+            os.remove(temp)
+            raise
+        log.debug('Toolpath to cache: {}'.format(fl))
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used files, while cache is too big """
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.gtp'):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:   # removed by other process
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+        files.sort()
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in files:
+            if total <= self.size:
+                break
+            log.debug('Remove from cache: {}'.format(name))
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,299 @@
+# cli.py
+#!/usr/bin/python
+"""
+Batch processing of gcode files without GUI.
+
+Usage: python -m gcode COMMAND FILE [FILE ...]
+
+Commands: check, strip-comments, stats, estimate, export, render.
+
+Directories are searched for *.gcode files. Files are processed in a pool
+of processes, results are written as JSON or CSV, one row per file.
+check needs only validator, numpy is imported for other commands.
+With --profile every result has timings of stages (see instrument.py).
+"""
+import os
+import sys
+import csv
+import json
+import logging
+import argparse
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+import tokenizer
+import validator
+import instrument
+
+
+def find_files(paths):
+    """ Return files of paths, directories are searched for *.gcode """
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            result.extend(os.path.join(root, name) for name in sorted(files)
+                          if name.lower().endswith('.gcode'))
+    return result
+
+
+def output_name(path, directory, suffix):
+    """ Return name of output file for path """
+    name = os.path.splitext(os.path.basename(path))[0] + suffix
+    return os.path.join(directory or os.path.dirname(path), name)
+
+
+def count_lines(path):
+    """ Return number of lines of file """
+    count = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    return count + (last != b'\n')
+
+
+def check(path, options):
+    """
+    Check file, return the first invalid line (number, text, column and
+    reason) and all diagnostics up to --max-errors
+    """
+    result = {'valid': True, 'line': None, 'text': None, 'column': None,
+              'reason': None, 'errors': 0, 'diagnostics': []}
+    with instrument.stage('validate') as stage:
+        found = validator.check_file(path, options.max_errors or None)
+        stage.points = len(found)
+    if found:
+        first = found[0]
+        lines = tokenizer.FileLines(path)   # lines like check_file has
+        text = next(islice(lines, first.line, None)).rstrip('\r')
+        result.update(valid=False, line=first.line, text=text,
+                      column=first.column, reason=first.reason,
+                      errors=len(found),
+                      diagnostics=[d._asdict() for d in found])
+    return result
+
+
+def strip_comments(path, options):
+    """ Write file without comments and empty lines """
+    out = output_name(path, options.output_dir, '.stripped.gcode')
+    count = 0
+    with instrument.stage('strip comments') as stage, open(out, 'w') as f:
+        for n, code in tokenizer.scan(tokenizer.FileLines(path)):
+            f.write(code.strip() + '\n')
+            count += 1
+        stage.points = count
+    return {'output': out, 'lines': count}
+
+
+def open_gcode(path, options):
+    """ Return gcode of file, which is parsed by --processes """
+    from gcode import gcode
+    g = gcode.from_file(path)
+    g.processes = options.processes or None   # 0 - number of CPUs
+    return g
+
+
+def stats(path, options):
+    """ Return numbers of lines, moves, layers, bounds and feedrates """
+    import numpy as np
+    g = open_gcode(path, options)
+    moves = g.move_array()
+    motions = int(gcode.is_motion(moves).sum())
+    result = {'lines': count_lines(path), 'moves': motions}
+    for name in ['x', 'y', 'z', 'feedrate']:
+        result[name + '_min'] = result[name + '_max'] = None
+    result['length'] = 0.
+    result['layers'] = 0
+    if motions > 1:
+        coords, lines = g.fill_moves(moves)
+        xyz = coords[:, :3]
+        for j, name in enumerate(['x', 'y', 'z']):
+            result[name + '_min'] = float(xyz[:, j].min() + g.mins[j])
+            result[name + '_max'] = float(xyz[:, j].max() + g.mins[j])
+        result['feedrate_min'] = float(g.fmin)
+        result['feedrate_max'] = float(g.fmin + g.fmax)
+        result['length'] = float(
+            np.sqrt(((xyz[1:] - xyz[:-1])**2).sum(axis=1)).sum())
+        result['layers'] = int((xyz[1:, 2] != xyz[:-1, 2]).sum()) + 1
+    return result
+
+
+def estimate(path, options):
+    """ Return print time (seconds), filament (mm, mm^3, g) and layers """
+    g = open_gcode(path, options)
+    result = g.estimate(options.acceleration, options.junction_deviation,
+                        options.max_speed)
+    return result.as_dict(options.filament_diameter, options.density)
+
+
+def export(path, options):
+    """ Save toolpath of file to binary file (.gtp) """
+    g = open_gcode(path, options)
+    g.spacing = options.spacing
+    toolpath = g.build_toolpath()
+    out = output_name(path, options.output_dir, '.gtp')
+    toolpath.save(out)
+    return {'output': out, 'dots': len(toolpath)}
+
+
+def render(path, options):
+    """ Save PNG (or GIF with --frames) of file without OpenGL """
+    g = open_gcode(path, options)
+    g.spacing = 0 if options.spacing is None else options.spacing
+    suffix = '.gif' if options.frames else '.png'
+    out = output_name(path, options.output_dir,
+                      '.{}{}'.format(options.view, suffix))
+    g.saveImage(out, options.view, options.size, options.layer,
+                options.frames)
+    return {'output': out}
+
+
+COMMANDS = {'check': check, 'strip-comments': strip_comments,
+            'stats': stats, 'estimate': estimate, 'export': export,
+            'render': render}
+
+
+def run(task):
+    """ Run command on one file, errors are returned as result """
+    command, path, options = task
+    result = {'file': path}
+    if options.profile:
+        instrument.enable(memory=options.profile == 'memory')
+    try:
+        result.update(COMMANDS[command](path, options))
+        result['error'] = None
+    except Exception as e:   # one bad file doesn't stop the batch
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if options.profile:
+            result['profile'] = instrument.disable().as_list()
+    return result
+
+
+def flatten(result):
+    """
+    Return result with profile as columns {stage}_{value} and diagnostics
+    as one string (for CSV)
+    """
+    result = dict(result)
+    if 'diagnostics' in result:
+        result['diagnostics'] = ' | '.join(
+            str(validator.Diagnostic(**d)) for d in result['diagnostics'])
+    for stage in result.pop('profile', []):
+        name = stage['stage'].replace(' ', '_')
+        for key in ('seconds', 'points', 'memory'):
+            result['{}_{}'.format(name, key)] = stage[key]
+    return result
+
+
+def write(results, fl, fmt):
+    """ Write results as JSON or CSV """
+    if fmt == 'json':
+        json.dump(results, fl, indent=2)
+        fl.write('\n')
+        return
+    results = [flatten(result) for result in results]
+    fields = []
+    for result in results:
+        fields.extend(key for key in result if key not in fields)
+    writer = csv.DictWriter(fl, fields, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='python -m gcode', description=(
+        'Check and convert gcode files without GUI.'))
+    p.add_argument('command', choices=sorted(COMMANDS))
+    p.add_argument('files', nargs='+', help='gcode files or directories')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of processes (default: number of CPUs)')
+    p.add_argument('-p', '--processes', type=int, default=1,
+                   help='processes, which parse every file, 0 - number of '
+                        'CPUs (default: 1); files are processed one by one '
+                        'then, for big files')
+    p.add_argument('-f', '--format', choices=['json', 'csv'],
+                   default='json', help='format of results')
+    p.add_argument('-o', '--output', default='-',
+                   help='file of results (default: stdout)')
+    p.add_argument('-d', '--output-dir', default=None,
+                   help='directory of converted files (default: near '
+                        'source files)')
+    p.add_argument('--spacing', type=float, default=None,
+                   help='distance between dots for export (default: '
+                        'fixed number of dots per line) and render '
+                        '(default: 0, only ends of lines)')
+    p.add_argument('--view', choices=['top', 'iso', 'layer'],
+                   default='top', help='view of render (default: top)')
+    p.add_argument('--size', type=int, default=256,
+                   help='width and height of render, pixels (default: 256)')
+    p.add_argument('--layer', type=int, default=None,
+                   help='layer of --view layer (default: the last one)')
+    p.add_argument('--frames', type=int, default=0,
+                   help='render animated GIF of drawing with this number '
+                        'of frames (default: PNG)')
+    p.add_argument('--acceleration', type=float, default=1000.,
+                   help='acceleration for estimate, mm/s^2 (default: 1000)')
+    p.add_argument('--junction-deviation', type=float, default=0.05,
+                   help='junction deviation for estimate, mm (default: '
+                        '0.05)')
+    p.add_argument('--max-speed', type=float, default=None,
+                   help='limit of speed for estimate, mm/s')
+    p.add_argument('--filament-diameter', type=float, default=1.75,
+                   help='filament diameter for estimate, mm (default: '
+                        '1.75)')
+    p.add_argument('--density', type=float, default=1.24,
+                   help='filament density for estimate, g/cm^3 (default: '
+                        '1.24)')
+    p.add_argument('--max-errors', type=int, default=validator.LIMIT,
+                   help='diagnostics of check per file, 0 - all of them '
+                        '(default: {})'.format(validator.LIMIT))
+    p.add_argument('--profile', nargs='?', const='time',
+                   choices=['time', 'memory'], default=None,
+                   help='add time and number of points of every stage to '
+                        'results; "memory" adds peak memory too (slower)')
+    p.add_argument('--log', default=None,
+                   help='file of debug log (default: no log, errors are '
+                        'written to results)')
+    return p
+
+
+def main(argv=None):
+    """
+    Run command over files and return exit status: 0 if every file is
+    valid and processed, 1 otherwise.
+    """
+    options = parser().parse_args(argv)
+    if options.log:
+        logging.basicConfig(
+            format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s '
+                   '%(message)s', level=logging.DEBUG, filename=options.log)
+    else:
+        logging.getLogger().addHandler(logging.NullHandler())
+    files = find_files(options.files)
+    if options.output_dir and not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+    tasks = [(options.command, path, options) for path in files]
+    # processes of pool can't have their own pools (--processes)
+    if options.jobs == 1 or len(tasks) < 2 or options.processes != 1:
+        results = list(map(run, tasks))
+    else:
+        pool = Pool(options.jobs)
+        try:
+            results = pool.map(run, tasks, chunksize=max(
+                1, len(tasks) // (8 * (options.jobs or cpu_count()))))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if options.output == '-':
+        write(results, sys.stdout, options.format)
+    else:
+        with open(options.output, 'w') as f:
+            write(results, f, options.format)
+    failed = [r for r in results if r['error'] or r.get('valid') is False]
+    return 1 if failed else 0
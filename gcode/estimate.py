@@ -0,0 +1,255 @@
+# estimate.py
+#!/usr/bin/python
+"""
+Estimation of print time and filament over arrays of moves.
+
+Every motion of tokenizer.motions is one move: its length, time under
+trapezoidal profile of speed (constant acceleration, speed at junctions
+limited like Grbl/Marlin junction deviation) and used filament.
+Everything is computed by whole arrays, there are no loops over moves.
+"""
+import numpy as np
+import arcs
+from gcode import gcode, GcodeError
+
+
+ACCELERATION = 1000.   # mm/s^2
+JUNCTION_DEVIATION = 0.05   # mm
+FILAMENT_DIAMETER = 1.75   # mm
+DENSITY = 1.24   # g/cm^3 (PLA)
+
+
+class Estimate(object):
+    """
+    Class for time and filament of moves, layers and the whole file
+
+    Attributes
+    ----------
+    lines : array of dtype int64, shape (n,)
+        Source line of every move.
+    lengths : array of dtype float, shape (n,)
+        Length of every move, mm (of filament for moves of extruder only).
+    durations : array of dtype float, shape (n,)
+        Time of every move, seconds.
+    filament : array of dtype float, shape (n,)
+        Filament, which is pushed by every move (negative for
+        retraction), mm.
+    z : array of dtype float, shape (k,)
+        Z of every layer.
+    starts, ends : arrays of dtype int64, shape (k,)
+        Range [start, end) of moves of every layer.
+    layer_durations, layer_filament : arrays of dtype float, shape (k,)
+        Time and filament of every layer.
+    time, length, total_filament : float
+        Totals of file: seconds, mm of moves, mm of filament.
+    volume, mass : float
+        Return volume (mm^3) and mass (g) of filament.
+    as_dict : dict
+        Return totals (for JSON).
+
+    Notes
+    -----
+    Like layers.Layers, a layer is a run of moves, which end on the same
+    Z. Moves without length (only feedrate) take no time.
+    """
+    def __init__(self, lines, lengths, durations, filament, z_ends):
+        self.lines = np.asarray(lines, dtype=np.int64)
+        self.lengths = lengths
+        self.durations = durations
+        self.filament = filament
+        n = len(lines)
+        if n:
+            starts = np.concatenate(
+                ([0], np.flatnonzero(z_ends[1:] != z_ends[:-1]) + 1))
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+        self.starts = starts.astype(np.int64)
+        self.ends = np.append(starts[1:], n).astype(np.int64)
+        self.z = z_ends[starts]
+        self.layer_durations = np.add.reduceat(durations, starts) if n \
+            else np.zeros(0)
+        self.layer_filament = np.add.reduceat(filament, starts) if n \
+            else np.zeros(0)
+        self.time = float(durations.sum())
+        self.length = float(lengths.sum())
+        self.total_filament = float(filament.sum())
+
+    def __len__(self):
+        return len(self.lines)
+
+    def volume(self, diameter=FILAMENT_DIAMETER):
+        """ Return volume of filament, mm^3 """
+        return self.total_filament * np.pi * diameter**2 / 4
+
+    def mass(self, diameter=FILAMENT_DIAMETER, density=DENSITY):
+        """ Return mass of filament, g """
+        return self.volume(diameter) * density / 1000
+
+    def as_dict(self, diameter=FILAMENT_DIAMETER, density=DENSITY):
+        """ Return totals as dict (for JSON) """
+        return {'moves': len(self), 'layers': len(self.starts),
+                'time': self.time, 'length': self.length,
+                'filament': self.total_filament,
+                'volume': self.volume(diameter),
+                'mass': self.mass(diameter, density)}
+
+
+def fill(column):
+    """
+    Return column with NaN replaced by the last known value before it
+    (by the first known value at the beginning, 0 if there is no one)
+    """
+    known = ~np.isnan(column)
+    if not known.any():
+        return np.zeros(len(column))
+    index = np.where(known, np.arange(len(column)), 0)
+    index[0] = known.argmax()
+    np.maximum.accumulate(index, out=index)
+    return column[index]
+
+
+def extrusion(moves):
+    """
+    Return filament of every row of moves (tokenizer.motions), mm
+
+    E is absolute by default and after M82, relative after M83; G92
+    sets E without extrusion.
+    """
+    mode = moves[:, 11]
+    reset = mode == 92
+    index = np.where(np.isnan(mode) | reset, 0, np.arange(len(moves)))
+    np.maximum.accumulate(index, out=index)
+    relative = (mode[index] == 83) & ~reset
+    position = gcode.absolute(moves[:, 10:11], relative)[:, 0]
+    position = np.nan_to_num(position)   # E is 0 before the first value
+    result = np.diff(np.concatenate(([0.], position)))
+    result[reset] = 0
+    return result
+
+
+def profile(lengths, speeds, directions, acceleration, deviation):
+    """
+    Return times of moves under trapezoidal profile of speed.
+
+    Parameters
+    ----------
+    lengths, speeds : arrays of dtype float, shape (n,)
+        Positive lengths (mm) and nominal speeds (mm/s) of moves.
+    directions : array of dtype float, shape (n, k)
+        Unit vectors of moves.
+    acceleration, deviation : float
+        Acceleration (mm/s^2) and junction deviation (mm).
+
+    Notes
+    -----
+    Squares of speeds at junctions are limited by junction deviation and
+    by speeds of both moves, then by acceleration over moves: s[j] <=
+    s[j-1] + 2*a*d[j-1] (forward) and s[j] <= s[j+1] + 2*a*d[j]
+    (backward). The greatest solution of each chain of inequalities is
+    a running minimum of cap - cumulative sum, so the planner's passes
+    are two np.minimum.accumulate. The printer stands at the beginning
+    and at the end.
+    """
+    a = float(acceleration)
+    square = speeds**2
+    cos = -np.einsum('ij,ij->i', directions[1:], directions[:-1])
+    np.clip(cos, -1, 1, out=cos)
+    sin = np.sqrt((1 - cos) / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cap = a * deviation * sin / (1 - sin)
+    cap = np.where(sin < 1 - 1e-9, cap, np.inf)   # straight line
+    cap = np.minimum(cap, np.minimum(square[1:], square[:-1]))
+    cap = np.concatenate(([0.], cap, [0.]))
+
+    gain = np.concatenate(([0.], np.cumsum(2 * a * lengths)))
+    s = gain + np.minimum.accumulate(cap - gain)
+    left = gain[-1] - gain   # gain from junction to the end
+    s = left + np.minimum.accumulate((s - left)[::-1])[::-1]
+    v = np.sqrt(np.maximum(s, 0))
+    v0 = np.minimum(v[:-1], speeds)
+    v1 = np.minimum(v[1:], speeds)
+
+    accelerate = (square - v0**2) / (2 * a)
+    decelerate = (square - v1**2) / (2 * a)
+    cruise = lengths - accelerate - decelerate
+    peak = np.where(cruise >= 0, speeds,
+                    np.sqrt(np.maximum((2 * a * lengths + v0**2 + v1**2) / 2,
+                                       0)))
+    return (2 * peak - v0 - v1) / a + np.maximum(cruise, 0) / speeds
+
+
+def estimate(moves, acceleration=ACCELERATION,
+             deviation=JUNCTION_DEVIATION, max_speed=None):
+    """
+    Return Estimate of moves.
+
+    Parameters
+    ----------
+    moves : array_like, shape (n, tokenizer.WIDTH)
+        Moves like gcode.move_array returns.
+    acceleration : float
+        Acceleration of all axes and extruder, mm/s^2.
+    deviation : float
+        Junction deviation, mm; 0 - stop at every corner.
+    max_speed : float or None
+        Limit of speed, mm/s (feedrate of G0 is used like the one of G1).
+    """
+    moves = np.asarray(moves, dtype=float)
+    if acceleration <= 0:
+        raise ValueError('acceleration must be positive')
+    mode = moves[:, 9]
+    index = np.where(np.isnan(mode), 0, np.arange(len(moves)))
+    np.maximum.accumulate(index, out=index)
+    relative = mode[index] == 91
+
+    # motions with any word (feedrate or E only too)
+    missing = np.isnan(moves)
+    words = ~missing[:, [0, 1, 2, 3, 6, 7, 8, 10]].all(axis=1)
+    rows = np.flatnonzero(words & ~missing[:, 5])
+    filament = extrusion(moves)
+    if len(rows) < len(moves):
+        moves, relative = moves[rows], relative[rows]
+        filament, missing = filament[rows], missing[rows]
+    lines = moves[:, 4]
+    g = moves[:, 5]
+
+    xyz = gcode.absolute(moves[:, :3], relative)
+    home = gcode.fill_unknown(xyz)   # like gcode.fill_moves
+    feed = fill(moves[:, 3])
+    delta = np.empty(xyz.shape)
+    for j in range(3):
+        delta[:, j] = np.diff(np.concatenate((xyz[:1, j], xyz[:, j])))
+    lengths = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+
+    arc = np.flatnonzero(((g == 2) | (g == 3)) &
+                         ~missing[:, 6:9].all(axis=1))
+    if len(arc):
+        clockwise = g[arc] == 2
+        end = xyz[arc]
+        begin = end - delta[arc]
+        begin[arc == 0] = home   # the first move
+        center = arcs.centers(begin[:, :2], end[:, :2], moves[arc, 6:8],
+                              moves[arc, 8], clockwise)
+        lengths[arc] = arcs.lengths(begin, end, center, clockwise)
+
+    # moves of extruder only: length and direction are the ones of E
+    extruder = (lengths == 0) & (filament != 0)
+    lengths[extruder] = np.abs(filament[extruder])
+    durations = np.zeros(len(moves))
+    moving = np.flatnonzero(lengths > 0)
+    if len(moving):
+        if len(moving) == len(lengths):
+            moving = slice(None)   # views instead of copies
+        speeds = feed[moving] / 60
+        if max_speed is not None:
+            speeds = np.minimum(speeds, max_speed)
+        if not (speeds > 0).all():
+            raise GcodeError('Please check feedrate')
+        length = lengths[moving]
+        directions = np.empty((len(length), 4))
+        directions[:, :3] = delta[moving] / length[:, None]
+        directions[:, 3] = np.where(extruder[moving],
+                                    np.sign(filament[moving]), 0)
+        durations[moving] = profile(length, speeds, directions,
+                                    acceleration, deviation)
+    return Estimate(lines, lengths, durations, filament, xyz[:, 2])
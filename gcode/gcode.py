@@ -1,26 +1,73 @@
 # gcode.py
 #!/usr/bin/python
-import re
+import gc
 import logging
-import opengl
+import hashlib
+import tokenizer
+import validator
+import instrument
+import arcs
 import numpy as np
-from gradient import main as grad
-from pyqtgraph import QtGui
+from gradient import cached as grad
+from toolpath import Toolpath
 
 
-log = "log.log"
-logging.basicConfig(
-    format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
-    level=logging.DEBUG, filename=log)
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())   # silent, if logging isn't configured
 MIN_COLOR = [0.0, 0.0, 1.0, 1.0]
 MAX_COLOR = [1.0, 0.0, 0.0, 1.0]
+COLOR_STEPS = 256   # size of feedrate -> color table
+OFFSET = [-40.0, -40.0, -40.0]    # translation of image
+VIEW_WIDTH = 10   # columns of moves, which toolpath needs (X ... mode)
 
 
 class GcodeError(Exception):
     """ Exception for invalid g-codes """
     def __init__(self, message):
         self.message = message
-        logging.error(self.message)
+        log.error(self.message)
+
+
+class NoCollection(object):
+    """
+    Garbage collector is off in with block: lists of moves have no
+    cycles, but collections while millions of them are made take longer
+    than parsing itself
+    """
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *args):
+        if self.enabled:
+            gc.enable()
+
+
+def invalid(error):
+    """ Return GcodeError with line, column and reason of TokenizeError """
+    column, reason = validator.explain(error.text) or (0, 'invalid gcode')
+    return GcodeError('Invalid g-codes: {}'.format(
+        validator.Diagnostic(error.line, column, reason)))
+
+
+def digest(text):
+    """ Return hash of gcode text (key of cache.Cache with settings) """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def load(path):
+    """ Return toolpath.Toolpath from file, which gcode.export writes """
+    return Toolpath.load(path)
+
+
+def save_toolpath(toolpath, path):
+    """ Save toolpath to file, return error message or None (if saved) """
+    try:
+        toolpath.save(path)
+    except (IOError, OSError) as e:
+        log.error('Toolpath is not exported: {}'.format(e))
+        return 'Toolpath is not exported: {}'.format(e)
+    return None
 
 
 class gcode(object):
@@ -31,16 +78,54 @@ class gcode(object):
     ----------
     check : bool
         Check, if value is valid gcode.
+    diagnostics : list
+        Find invalid lines: line, column and reason of every error.
+    tokens : generator
+        Generate words (letter, value, line) from text.
     del_comm : string
         Delete all comments from text and return string.
     coordinates : array
         Get all coordinates from text.
+    moves : array
+        Get all G1 moves [X, Y, Z, Feedrate, line] from text.
+    move_array : array
+        Get all motions (G0-G3) and modes (G90, G91) as one array.
+    view_moves : tuple
+        Get moves for toolpath in less memory (if compact is set).
+    from_file : gcode
+        Read gcode from file by lines, without whole text in memory.
     text : string
         Return gcode as string.
+    fill_moves : array
+        Return moves with filled modal values, arcs split into chords.
+    estimate : Estimate
+        Return print time and filament of moves, layers and file.
+    get_toolpath : Toolpath
+        Return dots with colors and source lines (from cache, if it's set).
     get_dots : array
         Return dots with colors
+    export : Toolpath
+        Save toolpath to binary file, which load maps without parsing.
+    drawing : None
+        Draw image step by step, from the beginning of layer.
+    show_image : None
+        Show image of all or some layers.
+    speed : int
+        Number of dots per line, if spacing is None.
+    spacing : float or None
+        Maximal distance between dots; 0 - only ends of lines, colors
+        between them are interpolated by OpenGL.
+    cache : cache.Cache or None
+        Persistent cache of toolpaths.
+    progress : function or None
+        Called with numbers of parsed lines and generated dots.
+    processes : int or None
+        Number of processes, which parse gcode.
+    compact : bool
+        Keep moves for toolpath as float32 without columns of extruder
+        (see view_moves), for big files.
     saveImage : None
-        Save image as gif file
+        Save image as PNG or animated GIF file without OpenGL.
 
     Parameters
     ----------
@@ -50,158 +135,593 @@ class gcode(object):
     current_feedrate = 0
     current_color = 0
     speed = 50  # not speed, 1/speed
+    spacing = None  # None - {speed} dots per line
+    cache = None    # cache.Cache of toolpaths
+    progress = None  # function(lines, dots), it may raise to stop parsing
+    processes = 1   # >1 - parse in process pool (None - by number of CPUs)
+    compact = False   # float32 moves for toolpath (see view_moves)
+    arc_tolerance = arcs.TOLERANCE   # maximal error of chords of G2/G3
+    chords = None   # moves, which are chords of arcs (from fill_moves)
 
     def __init__(self, text):
         self._text = str(text)
         # central value of class
         self.blocks = list(map(str, text.split('\n')))
 
+    @classmethod
+    def from_file(cls, path):
+        """ Return gcode, which reads lines from file only when needed """
+        self = cls('')
+        self._text = None
+        self.blocks = tokenizer.FileLines(path)
+        return self
+
     def check(self):   # full program
         """ Check if self.blocks contains valid gcode """
-        r = re.compile('(?!(^(((?!;)[A-Z][+-]?\d+(\.\d+)?\s?)*(\s*;\s.*)?)$))')
-        for line in self.blocks:
-            if r.match(line) and line and line != '\r' and line != '\n':
-                return False
-        return True
+        return not self.diagnostics(1)
+
+    def diagnostics(self, limit=validator.LIMIT):
+        """
+        Return list of validator.Diagnostic (line, column, reason)
+
+        The whole text is checked in one pass, no more than {limit}
+        errors are collected (None - all of them).
+        """
+        with instrument.stage('validate') as stage:
+            result = validator.check(self.blocks, limit)
+            stage.points = len(result)
+        return result
+
+    def tokens(self):
+        """ Return generator of words from self.blocks """
+        return tokenizer.tokenize(self.blocks)
 
     def del_comm(self, blocks=False):
         """ Delete all comments from text """
-        logging.debug('Delete comments from text')
-        if not(self.check()):
-            raise GcodeError("Invalid g-codes")
-        temp = []
-        comment = re.compile(';\ .*')
-        for line in self.blocks:
-            n = comment.search(line)
-            if n:
-                line = line[:n.span()[0]]
-            line = line.strip()
-            if line != "":
-                temp.append(line)
+        log.debug('Delete comments from text')
+        with instrument.stage('strip comments') as stage:
+            try:
+                temp = [code.strip()
+                        for n, code in tokenizer.scan(self.blocks)]
+            except tokenizer.TokenizeError as e:
+                raise invalid(e)
+            stage.points = len(temp)
         if blocks:
             return temp
         return "\n".join(temp)
 
     @property
     def coordinates(self):
-        """ Return all coordinates from self.blocks """
-        logging.debug('Get coordinates from text')
-        result = []
-        blocks = self.del_comm(blocks=True)
-        coor = re.compile('[FXYZ][+-]?[0-9]+(\.[0-9]+)?')
-        for line in blocks:
-            coord_line = False
-            comm = line.split()
-            temp = []
-            for c in comm:
-                if c == 'G1':
-                    coord_line = True
-                if coord_line and coor.match(c):
-                    temp.append(c)
-            if temp:
-                result.append(temp)
-        return result
+        """ Return all coordinates from self.blocks (words of text) """
+        log.debug('Get coordinates from text')
+        try:
+            with NoCollection():
+                return [words for part in
+                        tokenizer.coordinate_words(self.blocks)
+                        for words in part]
+        except tokenizer.TokenizeError as e:
+            raise invalid(e)
+
+    def moves(self):
+        """ Return list of G1 moves [X, Y, Z, Feedrate, line] """
+        try:
+            parts = list(tokenizer.coordinates(self.blocks))
+        except tokenizer.TokenizeError as e:
+            raise invalid(e)
+        moves = np.concatenate(parts) if parts else np.empty((0, 5))
+        with NoCollection():
+            result = moves.astype(object)
+            result[np.isnan(moves)] = None
+            result[:, 4] = moves[:, 4].astype(int)
+            return result.tolist()
+
+    def move_array(self):
+        """
+        Return array of motions like tokenizer.motions gives
+
+        Lines are parsed by blocks (see tokenizer.Block), so lists of
+        moves never hold the whole file. Missing values are NaN.
+        """
+        with instrument.stage('tokenize') as stage:
+            moves = self.parse_moves()
+            stage.points = len(moves)
+        return moves
+
+    def parse_moves(self):
+        """ Return moves for move_array (in process pool, if it's set) """
+        arrays = list(self.move_parts())
+        if not arrays:
+            return np.empty((0, tokenizer.WIDTH))
+        return np.concatenate(arrays)
+
+    def move_parts(self):
+        """ Generate arrays of moves by blocks of lines """
+        try:
+            if self.processes != 1:
+                import parallel   # multiprocessing only when it's used
+                yield parallel.move_array(self.blocks, self.processes,
+                                          self.report)
+                return
+            for part in tokenizer.motions(self.blocks):
+                yield part
+                if len(part):
+                    self.report(part[-1, 4] + 1, 0)
+        except tokenizer.TokenizeError as e:
+            raise invalid(e)
+
+    def view_moves(self):
+        """
+        Return moves for toolpath in less memory than move_array.
+
+        Returns
+        -------
+        moves : array of dtype float32, shape (n, VIEW_WIDTH)
+            Columns of move_array, which fill_modal uses (column of
+            lines is NaN, float32 has exact integers up to 2**24 only).
+        lines : array of dtype int32, shape (n,)
+            Source line of every move.
+        """
+        with instrument.stage('tokenize') as stage:
+            arrays, lines = [], []
+            for part in self.move_parts():
+                lines.append(part[:, 4].astype(np.int32))
+                part = part[:, :VIEW_WIDTH].astype(np.float32)
+                part[:, 4] = np.nan
+                arrays.append(part)
+            if not arrays:
+                return (np.empty((0, VIEW_WIDTH), dtype=np.float32),
+                        np.empty(0, dtype=np.int32))
+            moves = np.concatenate(arrays)
+            del arrays
+            stage.points = len(moves)
+            return moves, np.concatenate(lines)
+
+    def report(self, lines, dots):
+        """ Call self.progress, if it's set """
+        if self.progress is not None:
+            self.progress(int(lines), int(dots))
 
     @property
     def text(self):
         """ Return gcode as string """
+        if self._text is None:
+            with open(self.blocks.path) as f:
+                return f.read()
         return self._text
 
-    def get_dots(self):
-        """ Generate dots and return them """
-        logging.debug('Generate dots to draw')
-        gc = self.coordinates
-        coords = []
-        zmin = ymin = xmin = self.fmin = 999999
-        self.fmax = 0
-        for line in gc:
-            temp = [None, None, None, None]  # X, Y, Z, Feedrate
-            for c in line:
-                if c.startswith('X'):
-                    temp[0] = float(c[1:])
-                    xmin = min(xmin, temp[0])
-                elif c.startswith('Y'):
-                    temp[1] = float(c[1:])
-                    ymin = min(ymin, temp[1])
-                elif c.startswith('Z'):
-                    temp[2] = float(c[1:])
-                    zmin = min(zmin, temp[2])
-                elif c.startswith('F'):
-                    temp[3] = int(float(c[1:]))
-                    self.fmin = min(self.fmin, temp[3])
-                    self.fmax = max(self.fmax, temp[3])
-            if ((temp[0] is not None) or (temp[1] is not None) or
-               (temp[2] is not None) or (temp[3] is not None)):
-                if coords:
-                    if temp[0] is None:
-                        temp[0] = coords[-1][0]
-                    if temp[1] is None:
-                        temp[1] = coords[-1][1]
-                    if temp[2] is None:
-                        temp[2] = coords[-1][2]
-                    if temp[3] is None:
-                        temp[3] = coords[-1][3]
-                coords.append(temp)
-
-        if (self.fmin == 999999) or (self.fmax == 0):
+    def fill_moves(self, moves=None):
+        """
+        Fill modal values of moves.
+
+        Parameters
+        ----------
+        moves : array_like, shape (n, tokenizer.WIDTH), optional
+            Moves like move_array returns; by default moves of self.blocks.
+
+        Returns
+        -------
+        coords : array of dtype float, shape (m, 4)
+            X, Y, Z, Feedrate of every move. Missing values are taken
+            from previous move (or minimum), minimums are subtracted.
+        lines : array of dtype int32, shape (m,)
+            Source line of every move.
+
+        Notes
+        -----
+        Moves after G91 are relative, they are summed up from the last
+        absolute value. Arcs (G2, G3) are split into chords, which are
+        not farther than {self.arc_tolerance} from arc, so every chord is
+        a move here and m may be more than n. G0 is a move like G1.
+        """
+        log.debug('Fill modal values')
+        lines = None
+        if moves is None and self.compact:
+            moves, lines = self.view_moves()
+        elif moves is None:
+            moves = self.move_array()
+        with instrument.stage('fill modal') as stage:
+            coords, lines = self.fill_modal(moves, lines)
+            stage.points = len(coords)
+        return coords, lines
+
+    def fill_modal(self, moves, lines=None):
+        """
+        Return (coords, lines) of fill_moves for array of moves (and
+        source lines, if they aren't in moves like view_moves gives)
+        """
+        moves = np.asarray(moves)
+        if moves.dtype != np.float32:
+            moves = moves.astype(float, copy=False)
+        if lines is None:
+            lines = moves[:, 4]
+        # distance mode of every move is the last G90/G91 before it
+        mode = moves[:, 9]
+        index = np.where(np.isnan(mode), 0, np.arange(len(moves)))
+        np.maximum.accumulate(index, out=index)
+        relative = mode[index] == 91
+        motion = self.is_motion(moves)
+        moves, relative = moves[motion], relative[motion]
+
+        coords = moves[:, :4].astype(float)
+        lines = np.asarray(lines)[motion].astype(np.int32)
+        known = ~np.isnan(coords)
+
+        coords[:, 3] = np.trunc(coords[:, 3])
+        if not known[:, 3].any() or np.nanmax(coords[:, 3]) == 0:
             raise GcodeError('Please check feedrate')
-        if (xmin == ymin == zmin == 999999):
+        if not known[:, :3].any():
             raise GcodeError('Please check coordinates')
-        if xmin == 999999:
-            xmin = 0
-        if ymin == 999999:
-            ymin = 0
-        if zmin == 999999:
-            zmin = 0
-
-        for i in coords:   # if something is still 0
-            if i[0] is None:
-                i[0] = xmin
-            if i[1] is None:
-                i[1] = ymin
-            if i[2] is None:
-                i[2] = zmin
-            if i[3] is None:
-                i[3] = self.fmin
-            i[0] -= xmin
-            i[1] -= ymin
-            i[2] -= zmin
-            i[3] -= self.fmin
-
-        self.fmax -= self.fmin
-        self.colors_list = grad(MIN_COLOR, MAX_COLOR, self.fmax+1)
-
-        dots = []
-        for i in range(len(coords)):
-            temp = []
-            if i != len(coords)-1:
-                temp = self.getColorLine(coords[i], coords[i+1])
-            if temp:
-                dots.extend(temp)
-
-        return dots
+
+        # index of last known feedrate
+        index = np.where(known[:, 3], np.arange(len(coords)), 0)
+        np.maximum.accumulate(index, out=index)
+        coords[:, 3] = coords[index, 3]
+        coords[:, :3] = self.absolute(coords[:, :3], relative)
+        # before arcs are split, so they start from filled values
+        home = self.fill_unknown(coords[:, :3])
+        coords, lines = self.split_arcs(coords, lines, moves, home)
+
+        known = ~np.isnan(coords)
+        mins = np.array([np.nanmin(coords[:, j]) if known[:, j].any() else 0
+                         for j in range(4)])
+        self.mins = mins[:3]   # X, Y, Z, which are subtracted
+        self.fmin = int(mins[3])
+        self.fmax = int(np.nanmax(coords[:, 3])) - self.fmin
+        np.copyto(coords, mins, where=np.isnan(coords))   # if still None
+        coords -= mins
+        return coords, lines
+
+    @staticmethod
+    def is_motion(moves):
+        """
+        Return mask of moves, which are drawn: motions with X, Y, Z,
+        feedrate or arc words (not modes and not moves of extruder only)
+        """
+        words = np.concatenate((moves[:, :4], moves[:, 6:9]), axis=1)
+        return ~np.isnan(moves[:, 5]) & ~np.isnan(words).all(axis=1)
+
+    @staticmethod
+    def absolute(values, relative):
+        """
+        Return absolute coordinates of moves.
+
+        Parameters
+        ----------
+        values : array of dtype float, shape (n, k)
+            Coordinates of moves, NaN if they aren't changed.
+        relative : array of dtype bool, shape (n,)
+            Moves with relative coordinates (G91).
+
+        Returns
+        -------
+        values : array of dtype float, shape (n, k)
+            The last absolute value plus sum of relative ones after it
+            (from 0, if there is no absolute value before); NaN before
+            the first known value.
+        """
+        result = np.empty(values.shape)
+        n = np.arange(len(values))
+        for j in range(values.shape[1]):   # columns are contiguous here
+            column = np.ascontiguousarray(values[:, j])
+            known = ~np.isnan(column)
+            rel = known & relative
+            total = np.cumsum(np.where(rel, column, 0))
+            index = np.where(known & ~rel, n, -1)
+            np.maximum.accumulate(index, out=index)
+            last = np.maximum(index, 0)
+            base = column[last] - total[last]
+            seen = np.logical_or.accumulate(rel)   # relative from 0
+            base = np.where(index >= 0, base, np.where(seen, 0, np.nan))
+            result[:, j] = base + total
+        return result
+
+    @staticmethod
+    def fill_unknown(values):
+        """
+        Replace NaN of absolute coordinates (before the first known value)
+        with minimal known value of column, 0 if there is no one (in
+        place). Return values of fill: the position before the first move.
+
+        fill_modal and estimate.estimate fill moves so, they give the same
+        lengths and layers.
+        """
+        unknown = np.isnan(values)
+        home = np.array([0 if unknown[:, j].all() else np.nanmin(values[:, j])
+                         for j in range(values.shape[1])])
+        np.copyto(values, home, where=unknown)
+        return home
+
+    def split_arcs(self, coords, lines, moves, home=(0, 0, 0)):
+        """
+        Replace arcs of moves by chords (see fill_moves); arc, which is the
+        first move, starts from {home}
+        """
+        offsets = moves[:, 6:8]
+        g = moves[:, 5]
+        arc = (((g == 2) | (g == 3)) &
+               ~(np.isnan(offsets).all(axis=1) & np.isnan(moves[:, 8])))
+        self.chords = None
+        if not arc.any():
+            return coords, lines
+        rows = np.flatnonzero(arc)
+        end = coords[rows, :3]
+        start = coords[np.maximum(rows - 1, 0), :3]
+        start[rows == 0] = home
+        clockwise = moves[rows, 5] == 2
+        center = arcs.centers(start[:, :2], end[:, :2], offsets[rows],
+                              moves[rows, 8], clockwise)
+        counts, points = arcs.tessellate(start, end, center, clockwise,
+                                         self.arc_tolerance)
+        repeats = np.ones(len(coords), dtype=int)
+        repeats[rows] = counts
+        index = np.repeat(np.arange(len(coords)), repeats)
+        coords = coords[index]
+        self.chords = arc[index]
+        coords[self.chords, :3] = points
+        return coords, lines[index]
+
+    def segment_colors(self, feed):
+        """
+        Choose colors of all lines at once, like getColorLine does.
+
+        Parameters
+        ----------
+        feed : array_like of dtype int
+            Feedrates of moves (minus fmin).
+
+        Returns
+        -------
+        start, finish : arrays of dtype int, shape (n-1,)
+            Feedrates, which give colors of the beginning and of the end
+            of every line.
+        """
+        feed1 = feed[:-1]
+        feed2 = feed[1:]
+        n = len(feed1)
+        # self.current_feedrate of every line is feed1 (0 for the first)
+        fresh = feed1 == 0
+        fresh[:1] = True
+
+        start = feed1.copy()
+        finish = feed1.copy()
+        up = feed2 > feed1
+        finish[up] = feed2[up]
+        down = (feed1 > feed2) & ~fresh
+        start[down] = feed2[down]
+
+        # same feedrate keeps self.current_color
+        keep = (feed1 == feed2) & ~fresh
+        last = np.where(keep, 0, np.arange(n))
+        np.maximum.accumulate(last, out=last)
+        finish = finish[last]
+        start[keep] = finish[keep]
+
+        if n:
+            self.current_color = self.colors_lut[
+                self.color_index(finish[-1])].tolist()
+            self.current_feedrate = int(feed2[-1])
+        return start, finish
+
+    def color_index(self, feed):
+        """ Return indexes in self.colors_lut of feedrates (minus fmin) """
+        scale = (COLOR_STEPS-1) / float(max(self.fmax, 1))
+        return np.rint(np.asarray(feed) * scale).astype(int)
+
+    def dots_per_line(self, coords):
+        """
+        Return number of dots of every line between coords
+
+        Chords of arcs have one dot, if spacing is None, they are short
+        already.
+        """
+        if self.spacing is None:
+            counts = np.full(len(coords)-1, self.speed, dtype=int)
+            if self.chords is not None and len(self.chords) == len(coords):
+                counts[self.chords[1:]] = 1   # chords of arcs are short
+            return counts
+        if self.spacing == 0:
+            return np.ones(len(coords)-1, dtype=int)
+        length = np.sqrt(((coords[1:, :3] - coords[:-1, :3])**2).sum(axis=1))
+        return np.maximum(np.ceil(length / self.spacing), 1).astype(int)
+
+    def digest(self):
+        """ Return hash of gcode text """
+        if self._text is not None:
+            return digest(self._text)
+        h = hashlib.sha1()
+        with open(self.blocks.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def estimate(self, acceleration=None, deviation=None, max_speed=None,
+                 moves=None):
+        """
+        Return estimate.Estimate: time and filament of moves and layers
+
+        Acceleration (mm/s^2) and junction deviation (mm) are
+        estimate.ACCELERATION and estimate.JUNCTION_DEVIATION by default.
+        """
+        import estimate   # numpy only, but not needed for drawing
+        if moves is None:
+            moves = self.move_array()
+        if acceleration is None:
+            acceleration = estimate.ACCELERATION
+        if deviation is None:
+            deviation = estimate.JUNCTION_DEVIATION
+        with instrument.stage('estimate') as stage:
+            result = estimate.estimate(moves, acceleration, deviation,
+                                       max_speed)
+            stage.points = len(result)
+        return result
+
+    def settings(self):
+        """ Return parse settings, which change toolpath """
+        return (self.speed, self.spacing, MIN_COLOR, MAX_COLOR, COLOR_STEPS,
+                OFFSET, self.arc_tolerance, self.compact)
+
+    def get_toolpath(self):
+        """ Return toolpath from self.cache or generate it """
+        if self.cache is None:
+            return self.build_toolpath()
+        key = self.cache.key(self.digest(), self.settings())
+        toolpath = self.cached(key)
+        if toolpath is None:
+            toolpath = self.build_toolpath()
+            self.cache.put(key, toolpath)
+        return toolpath
+
+    def cached(self, key):
+        """ Return toolpath of key from self.cache (or None) """
+        toolpath = self.cache.get(key)
+        if toolpath is not None:
+            self.mins = toolpath.origin
+        if toolpath is not None and len(toolpath.feedrates):
+            self.fmin = int(toolpath.feedrates.min())
+            self.fmax = int(toolpath.feedrates.max()) - self.fmin
+        return toolpath
+
+    def build_toolpath(self, moves=None):
+        """
+        Generate dots and return them as toolpath.Toolpath
+
+        Every line has {self.speed} dots or one dot per {self.spacing}
+        of length, if spacing is set.
+        """
+        log.debug('Generate dots to draw')
+        coords, lines = self.fill_moves(moves)
+        with instrument.stage('color') as stage:
+            start, finish = self.line_colors(coords)
+            stage.points = len(start)
+        self.report(lines[-1] + 1, 0)
+        with instrument.stage('interpolate') as stage:
+            counts = self.dots_per_line(coords)
+            positions, colors, dot_lines = self.line_dots(
+                coords, lines, start, finish, counts)
+            stage.points = len(positions)
+        self.report(lines[-1] + 1, len(positions))
+        return Toolpath(positions, colors, dot_lines,
+                        feedrates=coords[:, 3] + self.fmin, offset=OFFSET,
+                        origin=self.mins)
+
+    def export(self, path):
+        """ Save toolpath to binary file, see load """
+        toolpath = self.get_toolpath()
+        toolpath.save(path)
+        return toolpath
+
+    def line_colors(self, coords):
+        """ Return indexes in self.colors_lut of colors of lines' ends """
+        self.colors_lut = grad(MIN_COLOR, MAX_COLOR, COLOR_STEPS)   # shared
+        start, finish = self.segment_colors(coords[:, 3].astype(int))
+        return self.color_index(start), self.color_index(finish)
+
+    def line_dots(self, coords, lines, start, finish, counts):
+        """
+        Generate dots of lines between coords.
+
+        Parameters
+        ----------
+        coords : array of dtype float, shape (n, 4)
+            Moves from fill_moves.
+        lines : array of dtype int, shape (n,)
+            Source lines of moves.
+        start, finish : arrays of dtype int, shape (n-1,)
+            Colors of lines' ends from line_colors.
+        counts : array of dtype int, shape (n-1,)
+            Number of dots of every line from dots_per_line.
+
+        Returns
+        -------
+        positions, colors, lines : arrays
+            Arrays for toolpath.Toolpath.
+        """
+        start = self.colors_lut[start]
+        finish = self.colors_lut[finish]
+        # with spacing 0 the end of line is a dot too
+        ends = int(self.spacing == 0)
+        line = np.repeat(np.arange(len(counts)), counts + ends)
+        offsets = np.cumsum(counts + ends) - (counts + ends)
+        step = np.arange(len(line)) - offsets[line]
+        n = counts[line]
+
+        xyz = coords[:, :3].astype(np.float32)
+        shift = (xyz[1:] - xyz[:-1]) / counts[:, None].astype(np.float32)
+        positions = xyz[line] + step[:, None].astype(np.float32) * shift[line]
+        # the same colors as gradient.array(start, finish, n+1)[:n]
+        t = step.astype(np.float32) / n.astype(np.float32)
+        colors = np.round(start[line] + t[:, None] *
+                          (finish[line] - start[line]), 2)
+        colors[step == 0] = start[line[step == 0]]
+
+        # dots of line are drawn by the move to its end
+        return positions, colors, lines[1:][line]
+
+    def get_dots(self):
+        """
+        Generate dots and return them
+
+        Returns
+        -------
+        dots : array of dtype float, shape (n, 7)
+            x, y, z, r, g, b, p of every dot.
+        """
+        toolpath = self.get_toolpath()
+        return np.hstack((toolpath.positions, toolpath.colors))
 
     def get_data(self):
-        logging.debug('Get data')
-        dots = np.array(self.get_dots())
-        data = dots[:, :3]
-        colors = dots[:, 3:]
-        if len(dots):
-            data = np.array([[x-40 for x in i] for i in data])
-
-        return data, colors
-
-    def drawing(self):
-        data, colors = self.get_data()
-        logging.debug(str(len(data))+" dots to draw")
-        a = opengl.App(data, colors)
+        log.debug('Get data')
+        toolpath = self.get_toolpath()
+
+        return toolpath.transformed(), toolpath.colors
+
+    def drawing(self, toolpath=None, layer=None):
+        """
+        Draw image step by step, from the beginning of layer, if given;
+        return opengl.App, which emits source lines of drawn dots
+        """
+        if toolpath is None:
+            toolpath = self.get_toolpath()
+        log.debug(str(len(toolpath))+" dots to draw")
+        import opengl   # GUI is loaded only for drawing
+        a = opengl.App(toolpath.positions, toolpath.colors,
+                       offset=toolpath.offset, layers=toolpath.layers,
+                       sourcemap=toolpath.sourcemap)
         a.drawing()
+        if layer is not None:
+            a.seek_layer(layer)
+        return a
 
-    def show_image(self):
-        data, colors = self.get_data()
-        logging.debug(str(len(data))+" dots to show")
-        a = opengl.App(data, colors)
+    def show_image(self, toolpath=None, first=None, last=None):
+        """
+        Show image, only layers [first, last], if first is given; return
+        opengl.App
+        """
+        if toolpath is None:
+            toolpath = self.get_toolpath()
+        if first is not None:
+            toolpath = toolpath.layer(first, last)
+        log.debug(str(len(toolpath))+" dots to show")
+        import opengl
+        levels = toolpath.levels   # the viewer builds them in background
+        log.debug('Levels of detail: {}'.format(
+            [len(index) for tolerance, index in levels]))
+        a = opengl.App(toolpath.positions, toolpath.colors,
+                       offset=toolpath.offset, levels=levels,
+                       layers=toolpath.layers, sourcemap=toolpath.sourcemap)
         a.show_image()
+        return a
+
+    def saveImage(self, path, view='top', size=256, layer=None, frames=0,
+                  toolpath=None):
+        """
+        Save image without OpenGL: PNG, or GIF of {frames} steps of
+        drawing (see raster.save); view is 'top', 'iso' or 'layer'
+        """
+        if toolpath is None:
+            toolpath = self.get_toolpath()
+        import raster   # only numpy, it works without display
+        raster.save(toolpath, path, size, view, layer, frames)
 
     def getColorLine(self, dot1, dot2):    # generate all dots of line
         """
@@ -216,8 +736,8 @@ class gcode(object):
 
         Returns
         -------
-        coords : array of dtype float
-            Dots, which are lies on line.
+        coords : list
+            Dots, which are lies on line: [x, y, z, r, g, b, p].
 
         Notes
         -----
@@ -225,11 +745,11 @@ class gcode(object):
         """
         x1, y1, z1, feed1 = dot1
         x2, y2, z2, feed2 = dot2
-        min_color = self.colors_list[feed1]
-        max_color = self.colors_list[feed2]
+        min_color = self.colors_lut[self.color_index(feed1)].tolist()
+        max_color = self.colors_lut[self.color_index(feed2)].tolist()
 
         # NB! feed1,feed2 >= 0; 0 = dot[3]-fmin
-        # self.colors_list = grad(MIN_COLOR, MAX_COLOR, self.fmax)
+        # self.colors_lut = grad(MIN_COLOR, MAX_COLOR, COLOR_STEPS)
         if self.current_feedrate == 0:
             start_color = min_color
             if feed2 > feed1:
@@ -249,22 +769,17 @@ class gcode(object):
 
         self.current_color = finish_color
         self.current_feedrate = feed2
+        # shared gradient, so lines of the same colors only copy it
         color_list = grad(start_color, finish_color, n=self.speed+1)
 
-        i = 0
-        coords = []
-        stepx = (x2-x1) / self.speed
-        stepy = (y2-y1) / self.speed
-        stepz = (z2-z1) / self.speed
-        for i in range(self.speed):
-            dot = [0, 0, 0, 0, 0, 0, 0]   # x, y, z, r, g, b, p
-            dot[0] = x1 + i*stepx
-            dot[1] = y1 + i*stepy
-            dot[2] = z1 + i*stepz
-            dot[3:7] = color_list[i]
-            coords.append(dot)
+        steps = np.arange(self.speed)
+        coords = np.empty((self.speed, 7))   # x, y, z, r, g, b, p
+        coords[:, 0] = x1 + steps*((x2-x1) / self.speed)
+        coords[:, 1] = y1 + steps*((y2-y1) / self.speed)
+        coords[:, 2] = z1 + steps*((z2-z1) / self.speed)
+        coords[:, 3:] = color_list[:self.speed]
 
-        return coords
+        return coords.tolist()
 
 
 if __name__ == "__main__":
@@ -272,8 +787,15 @@ if __name__ == "__main__":
     import timeit
     import sys
     import glob
+    import gradient
+    from pyqtgraph import QtGui
+
+    logfile = "log.log"
+    logging.basicConfig(
+        format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
+        level=logging.DEBUG, filename=logfile)
 
-    with open(log, 'w') as f:
+    with open(logfile, 'w') as f:
         pass
     logging.debug('Test file')
 
@@ -299,6 +821,306 @@ if __name__ == "__main__":
             with open(self.gcodes[3]) as f:
                 self.assertTrue(gcode(f.read()).check())
 
+        def test_e(self):
+            g = gcode('G1 X1 F100 ; comment\nM107\nG1 Y-1.5 E2')
+            self.assertEqual(g.coordinates, [['X1', 'F100'], ['Y-1.5']])
+            self.assertEqual(g.moves(), [[1.0, None, None, 100.0, 0],
+                                         [None, -1.5, None, None, 2]])
+
+        def test_f(self):
+            g = gcode('G1 X10 Y0 F100\nG91\nG1 X-5 Y5\nG90\n'
+                      'G3 X10 Y10 I0 J5\nG0 X0')
+            coords, lines = g.fill_moves()
+            self.assertEqual(coords[1, :2].tolist(), [5.0, 5.0])
+            self.assertEqual(coords[-2, :2].tolist(), [10.0, 10.0])
+            self.assertEqual(lines[-1], 5)
+            self.assertTrue(len(coords) > 4)   # arc is split
+            # Y isn't known: arc starts from filled Y (0)
+            coords, lines = gcode('G1 X2 F100\nG2 X4 I1 J0').fill_moves()
+            self.assertEqual(coords[-1, :2].tolist(), [2.0, 0.0])
+            self.assertAlmostEqual(coords[:, 1].max(), 1)   # half of circle
+            # the first move: arc starts from minimal X, Y, not from its end
+            coords, lines = gcode('G2 X2 Y0 I1 J0 F100\nG1 X0').fill_moves()
+            self.assertEqual(coords[-2, :2].tolist(), [2.0, 0.0])
+            self.assertAlmostEqual(coords[:, 1].max(), 1)
+            self.assertEqual(coords[:-1, 0].tolist(),
+                             sorted(coords[:-1, 0].tolist()))
+
+        def test_g(self):
+            g = gcode('G1 X1\nG1 x2\nG1 X1  Y2\nG1 X')
+            self.assertEqual([d[:2] for d in g.diagnostics()],
+                             [(1, 3), (2, 5), (3, 4)])
+            self.assertEqual(len(g.diagnostics(2)), 2)
+            self.assertRaises(GcodeError, g.del_comm)
+            import os
+            import tempfile
+            handle, path = tempfile.mkstemp('.gcode')
+            with os.fdopen(handle, 'wb') as f:   # not UTF-8, bare \r
+                f.write(b'G1 X1 F100\rG1 Y2\n; 200\xb0C\nG1 x\n')
+            try:
+                self.assertEqual([d[:2] for d in
+                                  gcode.from_file(path).diagnostics()],
+                                 [(2, 3)])
+            finally:
+                os.remove(path)
+
+        def test_h(self):
+            g = gcode('G1 X0 Y0 F6000\nG1 X100 E5\nG92 E0\nG1 Y10 E1')
+            e = g.estimate(acceleration=1000, deviation=0)
+            # 100 mm at 100 mm/s: 0.1 s to speed up, 0.9 s, 0.1 s to stop
+            self.assertAlmostEqual(e.durations[1], 1.1)
+            self.assertAlmostEqual(e.total_filament, 6)
+            self.assertEqual(e.lines.tolist(), [0, 1, 3])
+            # Z before the first one is filled like in fill_moves
+            g = gcode('G1 X0 Y0\nG1 Z1\nG1 Z-1 F100\nG1 X10\nG2 X12 I1 J0')
+            e = g.estimate()
+            coords, lines = g.fill_moves()
+            xyz = coords[:, :3]
+            length = np.sqrt(((xyz[1:] - xyz[:-1])**2).sum(axis=1)).sum()
+            self.assertAlmostEqual(e.length, length, places=1)   # chords
+            self.assertEqual(len(e.z),
+                             (xyz[1:, 2] != xyz[:-1, 2]).sum() + 1)
+
+        def test_i(self):
+            import raster
+            g = gcode('G1 X0 Y0 F100\nG1 X10 Y5 F200\nG1 Z1 X0')
+            image = raster.Raster(g.get_toolpath(), 32).image()
+            self.assertEqual(image.shape, (32, 32, 3))
+            self.assertEqual(image[0, 0].tolist(), [255, 255, 255])
+            self.assertTrue((image != 255).any(axis=2).sum() > 20)
+
+        def test_j(self):
+            g = gcode('G1 X0 Y0 F100\n; comment\nG1 X10\nG1 Y10')
+            source = g.get_toolpath().sourcemap
+            self.assertEqual(source.lines.tolist(), [2, 3])
+            self.assertEqual(source.dots_of_line(3), slice(g.speed,
+                                                           2 * g.speed))
+            self.assertEqual(source.line_of_dot(g.speed + 1), 3)
+            self.assertEqual(source.dots_of_line(1), slice(0, 0))
+
+        def test_k(self):
+            g = gcode('G1 X0 Y0 F100\nG1 X10 F200')
+            g.get_toolpath()
+            g.current_feedrate = 0
+            first = g.getColorLine((0, 0, 0, 0), (10, 0, 0, 0))
+            second = g.getColorLine((10, 0, 0, 0), (20, 0, 0, 0))
+            self.assertEqual([dot[3:] for dot in first],
+                             [dot[3:] for dot in second])
+            self.assertEqual(second[1][:3], [10 + 10. / g.speed, 0, 0])
+            colors = gradient.cached(MIN_COLOR, MAX_COLOR, 5)
+            self.assertIs(colors, gradient.cached(MIN_COLOR, MAX_COLOR, 5))
+            self.assertFalse(colors.flags.writeable)
+            self.assertEqual(colors.dtype, np.float32)
+            self.assertEqual(colors.tolist(),
+                             gradient.array(MIN_COLOR, MAX_COLOR, 5).tolist())
+            g.line_colors(np.zeros((2, 4)))
+            self.assertIs(g.colors_lut, gradient.cached(MIN_COLOR, MAX_COLOR,
+                                                        COLOR_STEPS))
+
+        def test_l(self):
+            text = 'G1 X0.1 Y0 F100\nM82\nG1 X10.3 E2\nG2 X0.1 I-5.1 J0'
+            g = gcode(text)
+            g.compact = True
+            moves, lines = g.view_moves()
+            self.assertEqual(moves.dtype, np.float32)
+            self.assertEqual(moves.shape, (4, VIEW_WIDTH))   # with M82
+            self.assertEqual(lines.tolist(), [0, 1, 2, 3])
+            coords, lines = g.fill_moves()
+            expected = gcode(text).fill_moves()
+            self.assertTrue(np.allclose(coords, expected[0], atol=1e-5))
+            self.assertEqual(lines.tolist(), expected[1].tolist())
+
+        def test_m(self):
+            import os
+            import shutil
+            import tempfile
+            import cache
+            path = tempfile.mkdtemp()
+            try:
+                toolpath = gcode('G1 X0 Y0 F100\nG1 X10').get_toolpath()
+                c = cache.Cache(path)
+                self.assertIsNone(c.get('a'))
+                for i, key in enumerate('abc'):
+                    c.put(key, toolpath)
+                    os.utime(c.filename(key), (i, i))
+                self.assertEqual(sorted(os.listdir(path)),
+                                 ['a.gtp', 'b.gtp', 'c.gtp'])
+                self.assertEqual(c.get('a').positions.tolist(),
+                                 toolpath.positions.tolist())
+                # 'a' is used now, 'b' is the least recently used one
+                c.size = 2 * os.path.getsize(c.filename('a'))
+                c.evict()
+                self.assertEqual(sorted(os.listdir(path)),
+                                 ['a.gtp', 'c.gtp'])
+                self.assertIsNone(c.get('b'))
+            finally:
+                shutil.rmtree(path)
+
+        def test_n(self):
+            import shutil
+            import tempfile
+            import cache
+            import incremental
+            lines = ['G1 X0 Y0 F100', 'G1 X10 F200', 'G1 Y10', 'G1 X0']
+            document = incremental.Document()
+            document.set_text('\n'.join(lines))
+            document.toolpath()
+            document.update(1, 2, ['G1 X5 F300', 'G91', 'G1 Y5', 'G90'])
+            lines[1:3] = ['G1 X5 F300', 'G91', 'G1 Y5', 'G90']
+            text = '\n'.join(lines)
+            toolpath = document.toolpath()
+            dots = np.hstack((toolpath.positions, toolpath.colors))
+            self.assertEqual(dots.tolist(), gcode(text).get_dots().tolist())
+            path = tempfile.mkdtemp()
+            try:
+                document.gcode.cache = cache.Cache(path)
+                key = document.gcode.cache.key(digest(text),
+                                               document.gcode.settings())
+                document.toolpath(digest(text))   # put
+                cached = document.gcode.cache.get(key)
+                self.assertEqual(cached.positions.tolist(),
+                                 toolpath.positions.tolist())
+                document.regenerate = None   # cache only
+                self.assertEqual(
+                    document.toolpath(digest(text)).lines.tolist(),
+                    toolpath.lines.tolist())
+            finally:
+                shutil.rmtree(path)
+
+        def test_o(self):
+            import os
+            import tempfile
+            import parallel
+            lines = ['G1 X{} Y{} F{}'.format(i, i % 7, 100 + i % 3)
+                     for i in range(300)]
+            lines[50:50] = ['G91', '; relative', 'G1 X1 Y1', 'G90']
+            text = '\n'.join(lines)
+            sizes = parallel.CHUNK_SIZE, parallel.CHUNK_LINES
+            handle, path = tempfile.mkstemp('.gcode')
+            with os.fdopen(handle, 'w') as f:
+                f.write(text)
+            # lines cross ends of parts, which aren't multiple of lines
+            parallel.CHUNK_SIZE, parallel.CHUNK_LINES = 1000, 70
+            try:
+                serial = gcode(text).move_array()
+                for g in (gcode(text), gcode.from_file(path)):
+                    g.processes = 2
+                    moves = g.move_array()
+                    missing = np.isnan(moves)
+                    self.assertTrue(np.array_equal(missing,
+                                                   np.isnan(serial)))
+                    self.assertTrue(np.array_equal(moves[~missing],
+                                                   serial[~missing]))
+                lines[100] = lines[250] = 'G1 X'
+                with self.assertRaises(GcodeError) as serial:
+                    gcode('\n'.join(lines)).move_array()
+                g = gcode('\n'.join(lines))
+                g.processes = 2
+                with self.assertRaises(GcodeError) as error:
+                    g.move_array()   # the first invalid line
+                self.assertEqual(error.exception.message,
+                                 serial.exception.message)
+                self.assertIn('101', error.exception.message)
+            finally:
+                parallel.CHUNK_SIZE, parallel.CHUNK_LINES = sizes
+                os.remove(path)
+
+        def test_p(self):
+            g = gcode('G1 X0 Y0 Z0.2 F100\nG1 X10\nG1 Z0.4\nG1 X0\n'
+                      'G1 Z0.6\nG1 X10')
+            toolpath = g.get_toolpath()
+            self.assertEqual(toolpath.origin.tolist(), [0, 0, 0.2])
+            layers = toolpath.layers
+            self.assertEqual(layers.z.tolist(), [0.2, 0.4, 0.6])
+            self.assertEqual(layers.layer_at(0.4), 1)
+            self.assertEqual(layers.layer_at(0.3), 1)
+            self.assertEqual(layers.layer_at(0.1), 0)
+
+        def test_q(self):
+            import os
+            import tempfile
+            g = gcode('G1 X5 Y5 Z0.2 F100\nG1 X10 F200\nG1 Z0.4\nG1 Y10')
+            toolpath = g.get_toolpath().translate((1, 2, 3))
+            handle, path = tempfile.mkstemp('.gtp')
+            os.close(handle)
+            try:
+                toolpath.save(path)
+                loaded = Toolpath.load(path)
+                self.assertFalse(loaded.positions.flags.writeable)   # mapped
+                for name in ('positions', 'colors', 'lines', 'feedrates',
+                             'offset', 'origin'):
+                    self.assertTrue(np.array_equal(getattr(loaded, name),
+                                                   getattr(toolpath, name)))
+                for name in ('z', 'starts', 'ends', 'first_lines',
+                             'last_lines'):
+                    self.assertEqual(
+                        getattr(loaded.layers, name).tolist(),
+                        getattr(toolpath.layers, name).tolist())
+                del loaded
+                with open(path, 'rb') as f:
+                    data = f.read()
+                with open(path, 'wb') as f:
+                    f.write(data[:len(data) - 8])
+                self.assertRaises(ValueError, Toolpath.load, path)
+                with open(path, 'wb') as f:
+                    f.write(b'G1 X0 Y0 F100\n' * 20)
+                self.assertRaises(ValueError, Toolpath.load, path)
+            finally:
+                os.remove(path)
+
+        def test_r(self):
+            import os
+            import shutil
+            import tempfile
+            toolpath = gcode('G1 X0 Y0 F100\nG1 X10').get_toolpath()
+            path = tempfile.mkdtemp()
+            try:
+                fl = os.path.join(path, 'a.gtp')
+                self.assertIsNone(save_toolpath(toolpath, fl))   # export
+                self.assertEqual(load(fl).positions.tolist(),
+                                 toolpath.positions.tolist())
+                error = save_toolpath(toolpath, os.path.join(path, 'no',
+                                                             'a.gtp'))
+                self.assertIn('not exported', error)
+            finally:
+                shutil.rmtree(path)
+
+        def test_s(self):
+            import os
+            import tempfile
+            import lod
+            points = np.cumsum(np.random.RandomState(0).normal(
+                size=(3000, 3)), axis=0)
+            points[:, 2] = np.arange(3000) // 1000   # three layers
+            keep = lod.rdp(points, 2., [0, 1000, 2000])
+            self.assertTrue(keep[[0, 999, 1000, 1999, 2000, 2999]].all())
+            kept = np.flatnonzero(keep)
+            removed = np.flatnonzero(~keep)
+            b = kept[np.searchsorted(kept, removed)]
+            a = kept[np.searchsorted(kept, removed) - 1]
+            chord = points[b] - points[a]
+            inner = points[removed] - points[a]
+            cross = np.cross(inner, chord)
+            dist = np.sqrt((cross**2).sum(axis=1) / (chord**2).sum(axis=1))
+            self.assertTrue(dist.max() <= 2.)
+            self.assertTrue(len(kept) < 1000)
+            # levels are saved with toolpath
+            toolpath = Toolpath(points, np.ones((3000, 4)), np.arange(3000))
+            minimal, lod.MIN_DOTS = lod.MIN_DOTS, 1000
+            handle, path = tempfile.mkstemp('.gtp')
+            os.close(handle)
+            try:
+                toolpath.save(path)
+                levels = Toolpath.load(path).levels
+                self.assertEqual(len(levels), len(lod.TOLERANCES) + 1)
+                for level, expected in zip(levels, toolpath.levels):
+                    self.assertEqual(level[0], expected[0])
+                    self.assertEqual(level[1].tolist(), expected[1].tolist())
+                self.assertEqual(toolpath[:10].levels, [])
+            finally:
+                lod.MIN_DOTS = minimal
+                os.remove(path)
+
     suite = unittest.TestLoader().loadTestsFromTestCase(Test)
     unittest.TextTestRunner(verbosity=2).run(suite)
     print('1.000.000 checked codes - ' +
@@ -1,5 +1,10 @@
 # gradient.py
 #!/usr/bin/python
+from collections import OrderedDict
+import numpy as np
+
+CACHE_SIZE = 1024   # gradients, which are kept by cached
+_gradients = OrderedDict()   # the least recently used gradient is the first
 
 
 def RGB_to_gl(RGB, p=0.9):
@@ -26,15 +31,48 @@ def main(start=[0.0, 1.0, 0, 0.8], finish=[1.0, 0.0, 0, 0.9], n=40):
     return RGB_list
 
 
+def array(start=[0.0, 1.0, 0, 0.8], finish=[1.0, 0.0, 0, 0.9], n=40):
+    ''' Batched main: returns float32 array of (n) colors between
+    two colors. Start and finish may be arrays of colors with shape
+    (..., 4), then result has shape (..., n, 4) '''
+    s = np.asarray(start, dtype=np.float32)[..., None, :]
+    f = np.asarray(finish, dtype=np.float32)[..., None, :]
+    t = np.arange(n, dtype=np.float32)[:, None] / max(n-1, 1)
+
+    colors = np.round(s + t * (f-s), 2)
+    colors[..., :1, :] = s
+    return colors
+
+
+def _cached(start, finish, n):
+    key = (start, finish, n)
+    colors = _gradients.pop(key, None)
+    if colors is None:
+        colors = array(start, finish, n)
+        colors.flags.writeable = False
+        if len(_gradients) >= CACHE_SIZE:
+            _gradients.popitem(last=False)
+    _gradients[key] = colors   # the most recently used now
+    return colors
+
+
+def cached(start=[0.0, 1.0, 0, 0.8], finish=[1.0, 0.0, 0, 0.9], n=40):
+    ''' Memoized array of two colors: returns read-only float32 array
+    (n, 4). Equal (start, finish, n) share one array, the least recently
+    used of CACHE_SIZE gradients are dropped '''
+    return _cached(tuple(float(i) for i in start),
+                   tuple(float(i) for i in finish), int(n))
+
+
 if __name__ == '__main__':
     import logging
 
-    log = 'log.log'
+    logfile = 'log.log'
     logging.basicConfig(
         format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
-        level=logging.DEBUG, filename=log)
+        level=logging.DEBUG, filename=logfile)
 
-    with open(log, 'w') as f:
+    with open(logfile, 'w') as f:
         pass
     logging.debug('Test file')
     gradient = main([0.0, 1.0, 0.0, 0.8], [1.0, 0.0, 0.0, 0.9])
@@ -0,0 +1,185 @@
+# incremental.py
+#!/usr/bin/python
+import logging
+import numpy as np
+import tokenizer
+from gcode import gcode, GcodeError, OFFSET
+from toolpath import Toolpath
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class Document(object):
+    """
+    Parse cache of editor lines, which parses only changed lines
+
+    Attributes
+    ----------
+    update : None
+        Replace some lines with new ones and parse only them.
+    set_text : None
+        Replace all lines.
+    toolpath : Toolpath
+        Return toolpath from cache of settings or regenerate only
+        changed lines.
+
+    Parameters
+    ----------
+    settings : gcode
+        Object with parse settings (speed, spacing), by default gcode('').
+
+    Notes
+    -----
+    Moves after changed lines change too, while their filled modal values
+    (X, Y, Z, Feedrate) or colors differ from the old ones. Old and new
+    lines of toolpath are compared and dots are generated only for lines,
+    which differ. Arrays of the previous toolpath are never changed, so
+    toolpath can be generated in other thread and stopped by
+    settings.progress.
+    """
+    def __init__(self, settings=None):
+        if settings is None:
+            settings = gcode('')
+        self.gcode = settings
+        self.count = 0   # number of lines
+        self.moves = np.empty((0, tokenizer.WIDTH))   # tokenizer.motions
+        self.invalid = np.empty(0, dtype=int)   # lines with invalid gcode
+        self.table = np.empty((0, 9))   # lines of toolpath
+        self._toolpath = None
+
+    def set_text(self, text):
+        """ Replace all lines """
+        self.update(0, self.count, text.split('\n'))
+
+    def update(self, first, removed, lines):
+        """
+        Replace some lines with new ones and parse only them.
+
+        Parameters
+        ----------
+        first : int
+            Number of the first changed line.
+        removed : int
+            Number of old lines, which are replaced.
+        lines : list of strings
+            New lines.
+        """
+        end = first + removed
+        delta = len(lines) - removed
+
+        invalid = []
+        moves = []
+        i = 0
+        while i < len(lines):   # blocks between invalid lines
+            try:
+                moves.extend(list(tokenizer.motions(lines[i:], first + i)))
+                break
+            except tokenizer.TokenizeError as e:
+                bad = e.line - first
+                moves.extend(tokenizer.motions(lines[i:bad], first + i))
+                invalid.append(e.line)
+                i = bad + 1
+        moves = np.concatenate(moves) if moves else \
+            np.empty((0, tokenizer.WIDTH))
+
+        number = self.moves[:, 4]
+        a, b = np.searchsorted(number, [first, end])
+        tail = self.moves[b:].copy()
+        tail[:, 4] += delta
+        self.moves = np.concatenate((self.moves[:a], moves, tail))
+
+        i, j = np.searchsorted(self.invalid, [first, end])
+        self.invalid = np.concatenate((self.invalid[:i], invalid,
+                                       self.invalid[j:] + delta)).astype(int)
+        self.count += delta
+        log.debug('Parse lines {}-{}'.format(first, first+len(lines)))
+
+    def toolpath(self, digest=None):
+        """
+        Return toolpath, where only changed lines are regenerated.
+
+        Parameters
+        ----------
+        digest : string or None
+            Hash of text (gcode.digest): toolpath is taken from cache of
+            settings (settings.cache), if it's there, and it's put there
+            otherwise. The state of document isn't changed by cache, so
+            later changes are compared with the last generated toolpath.
+        """
+        if len(self.invalid):
+            raise GcodeError('Invalid g-codes in line {}'.format(
+                self.invalid[0]+1))
+        g = self.gcode
+        key = None
+        if digest is not None and g.cache is not None:
+            key = g.cache.key(digest, g.settings())
+            toolpath = g.cached(key)
+            if toolpath is not None:
+                return toolpath
+        toolpath = self.regenerate()
+        if key is not None:
+            g.cache.put(key, toolpath)
+        return toolpath
+
+    def regenerate(self):
+        """ Return toolpath, where only changed lines are regenerated """
+        g = self.gcode
+        coords, lines = g.fill_moves(self.moves)
+        start, finish = g.line_colors(coords)
+        counts = g.dots_per_line(coords)
+        table = np.column_stack((coords[:-1, :3], coords[1:, :3],
+                                 start, finish, counts))
+        g.report(self.count, 0)
+
+        old = self.table
+        if self._toolpath is None:
+            first, last, tail = 0, len(table), 0
+        else:
+            first, last, tail = self.difference(old, table)
+        log.debug('Generate lines {}-{} of {}'.format(
+            first, last, len(table)))
+
+        new = g.line_dots(coords[first:last+1], lines[first:last+1],
+                          start[first:last], finish[first:last],
+                          counts[first:last])
+        ends = int(g.spacing == 0)
+        # source lines move after inserted or removed lines
+        dot_lines = np.repeat(lines[1:], counts + ends)
+        if self._toolpath is None:
+            positions, colors = new[0], new[1]
+        else:
+            offsets = np.concatenate(([0], np.cumsum(old[:, 8] + ends)))
+            a = int(offsets[first])
+            b = int(offsets[len(old) - tail])
+            t = self._toolpath
+            positions = np.concatenate((t.positions[:a], new[0],
+                                        t.positions[b:]))
+            colors = np.concatenate((t.colors[:a], new[1], t.colors[b:]))
+        g.report(self.count, len(positions))
+
+        self.table = table
+        self._toolpath = Toolpath(positions, colors, dot_lines,
+                                  feedrates=coords[:, 3] + g.fmin,
+                                  offset=OFFSET, origin=g.mins)
+        return self._toolpath
+
+    @staticmethod
+    def difference(old, new):
+        """
+        Compare old and new lines of toolpath.
+
+        Returns
+        -------
+        (first, last, tail) : tuple of ints
+            New lines [first, last) differ from old ones, the last {tail}
+            lines are the same.
+        """
+        k = min(len(old), len(new))
+        same = (old[:k] == new[:k]).all(axis=1)
+        first = k if same.all() else int(np.argmin(same))
+        same = (old[len(old)-k:] == new[len(new)-k:]).all(axis=1)[::-1]
+        tail = k if same.all() else int(np.argmin(same))
+        tail = min(tail, k - first)
+        return first, len(new) - tail, tail
@@ -0,0 +1,132 @@
+# instrument.py
+#!/usr/bin/python
+"""
+Timings of stages of gcode processing.
+
+Stages are marked by ``with stage(name) as s: ...; s.points = n``. While
+no report is enabled, stage returns one shared dummy object, so marks
+cost nothing in the code.
+"""
+import time
+try:
+    import tracemalloc
+except ImportError:   # python 2
+    tracemalloc = None
+
+clock = getattr(time, 'perf_counter', time.time)
+report = None   # Report, which is filled now, or None
+
+
+class Stage(object):
+    """
+    One measured stage
+
+    Attributes
+    ----------
+    name : string
+        Name of stage.
+    seconds : float
+        Wall time.
+    points : int or None
+        Number of moves or dots, which stage produced.
+    memory : int or None
+        Peak of memory allocated in stage, bytes (if memory is traced).
+    """
+    def __init__(self, name, report):
+        self.report = report
+        self.name = name
+        self.seconds = 0.
+        self.points = None
+        self.memory = None
+
+    def __enter__(self):
+        if self.report.memory:
+            self.base = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = clock() - self.start
+        if self.report.memory:
+            self.memory = tracemalloc.get_traced_memory()[1] - self.base
+        self.report.stages.append(self)
+        return False
+
+    def as_dict(self):
+        return {'stage': self.name, 'seconds': self.seconds,
+                'points': self.points, 'memory': self.memory}
+
+
+class NoStage(object):
+    """ Stage, which measures nothing """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+class Report(object):
+    """
+    Stages in order of their end
+
+    Stages aren't nested, so total time is the sum of them.
+
+    Parameters
+    ----------
+    memory : bool
+        Trace peak memory of stages by tracemalloc (slower).
+    """
+    def __init__(self, memory=False):
+        self.stages = []
+        self.memory = memory and tracemalloc is not None
+        self.tracing = False   # tracemalloc is started by report
+
+    def total(self):
+        """ Return time of all stages """
+        return sum(s.seconds for s in self.stages)
+
+    def as_list(self):
+        """ Return stages as list of dicts (for JSON) """
+        return [s.as_dict() for s in self.stages]
+
+    def __str__(self):
+        rows = ['{:<16}{:>10}{:>12}{:>12}'.format(
+            'stage', 'seconds', 'points', 'memory')]
+        for s in self.stages:
+            rows.append('{:<16}{:>10.4f}{:>12}{:>12}'.format(
+                s.name, s.seconds, '-' if s.points is None else s.points,
+                '-' if s.memory is None else s.memory))
+        rows.append('{:<16}{:>10.4f}'.format('total', self.total()))
+        return '\n'.join(rows)
+
+
+def stage(name):
+    """ Return context manager, which measures stage, if report is on """
+    if report is None:
+        return NO_STAGE
+    return Stage(name, report)
+
+
+def enable(memory=False):
+    """ Start new report and return it """
+    global report
+    report = Report(memory)
+    if report.memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        report.tracing = True
+    return report
+
+
+def disable():
+    """ Stop report and return it """
+    global report
+    result, report = report, None
+    if result is not None and result.tracing:
+        tracemalloc.stop()
+    return result
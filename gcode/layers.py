@@ -0,0 +1,116 @@
+# layers.py
+#!/usr/bin/python
+import numpy as np
+
+
+DECIMALS = 4   # float32 positions have error < 0.00005 up to Z 1000
+
+
+class Layers(object):
+    """
+    Index of layers of toolpath: ranges of dots and source lines by Z
+
+    Attributes
+    ----------
+    z : array of dtype float, shape (k,)
+        Z of every layer in source coordinates (rounded to {DECIMALS}
+        decimals, positions are float32).
+    starts, ends : arrays of dtype int64, shape (k,)
+        Range [start, end) of dots of every layer.
+    first_lines, last_lines : arrays of dtype int64, shape (k,)
+        Range [first, last) of source lines of every layer.
+    dots : slice
+        Return slice of dots of layers.
+    lines : tuple
+        Return range of source lines of layers.
+    layer_of_dot, layer_of_line, layer_at : int
+        Return number of layer by dot, source line or Z.
+
+    Parameters
+    ----------
+    positions : array of dtype float, shape (n, 3)
+        Dots of toolpath.
+    lines : array of dtype int, shape (n,)
+        Source line of every dot.
+    origin : float
+        Z, which is subtracted from source Z in positions.
+
+    Notes
+    -----
+    Every dot belongs to the layer of the end of its move, so dots of
+    the move, which lifts the nozzle, belong to the new layer. A layer
+    is a run of moves, which end on the same Z, so every Z-hop gives
+    two short layers. Layers are found once in O(n), then every search
+    is O(log k) by np.searchsorted.
+    """
+    def __init__(self, positions, lines, origin=0.):
+        positions = np.asarray(positions)
+        lines = np.asarray(lines)
+        n = len(lines)
+        if n == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            self.z = np.zeros(0)
+            self.starts = self.ends = empty
+            self.first_lines = self.last_lines = empty
+            self.order = empty
+            return
+        # dots of a move are contiguous and begin from the start of the
+        # move, so the end of a move is the first dot of the next one
+        firsts = np.concatenate(([0], np.flatnonzero(lines[1:] != lines[:-1])
+                                 + 1))
+        counts = np.diff(np.append(firsts, n))
+        ends = np.append(firsts[1:], n - 1)
+        z = np.repeat(positions[ends, 2], counts)
+        starts = np.concatenate(([0], np.flatnonzero(z[1:] != z[:-1]) + 1))
+        self.z = np.round(z[starts].astype(float) + origin, DECIMALS)
+        self.starts = starts
+        self.ends = np.append(starts[1:], n)
+        self.first_lines = lines[starts].astype(np.int64)
+        self.last_lines = lines[self.ends - 1].astype(np.int64) + 1
+        self.order = np.argsort(self.z, kind='mergesort')   # stable
+
+    @classmethod
+    def from_index(cls, z, starts, ends, first_lines, last_lines):
+        """ Return layers from saved arrays (e.g. of toolpath file) """
+        self = cls.__new__(cls)
+        self.z = np.asarray(z, dtype=float)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.first_lines = np.asarray(first_lines, dtype=np.int64)
+        self.last_lines = np.asarray(last_lines, dtype=np.int64)
+        self.order = np.argsort(self.z, kind='mergesort')   # stable
+        return self
+
+    def __len__(self):
+        return len(self.starts)
+
+    def dots(self, first, last=None):
+        """ Return slice of dots of layers [first, last] """
+        if last is None:
+            last = first
+        return slice(int(self.starts[first]), int(self.ends[last]))
+
+    def lines(self, first, last=None):
+        """ Return range [first, last) of source lines of layers """
+        if last is None:
+            last = first
+        return int(self.first_lines[first]), int(self.last_lines[last])
+
+    def layer_of_dot(self, dot):
+        """ Return number of layer, which contains dot """
+        return int(np.searchsorted(self.starts, dot, side='right')) - 1
+
+    def layer_of_line(self, line):
+        """ Return number of layer, which contains source line """
+        i = int(np.searchsorted(self.first_lines, line, side='right')) - 1
+        return max(i, 0)
+
+    def layer_at(self, z):
+        """
+        Return number of layer with the least Z, which is not less than z.
+
+        If some layers have the same Z, the first of them is returned; if
+        all layers are lower, the highest one is returned.
+        """
+        i = int(np.searchsorted(self.z[self.order], z, side='left'))
+        return int(self.order[min(i, len(self) - 1)])
@@ -0,0 +1,140 @@
+# lod.py
+#!/usr/bin/python
+import numpy as np
+
+
+TOLERANCES = [0.05, 0.2, 1.0, 4.0]   # mm
+MIN_DOTS = 100000   # smaller toolpaths are drawn without decimation
+MAX_PASSES = 64   # levels of recursion of rdp, dots deeper are all left
+
+
+def rdp(points, tolerance, starts=(0,)):
+    """
+    Ramer-Douglas-Peucker algorithm.
+
+    Parameters
+    ----------
+    points : array of dtype float, shape (n, 3)
+        Dots of line strips.
+    tolerance : float
+        Maximal distance between removed dots and new line strips.
+    starts : array_like of dtype int
+        Indexes of the first dots of line strips.
+
+    Returns
+    -------
+    keep : array of dtype bool, shape (n,)
+        Dots, which are left.
+
+    Notes
+    -----
+    All segments of all strips are split at once: every pass finds the
+    farthest dot of every segment (NumPy over all dots, which aren't
+    decided yet), so there are as many passes as levels of recursion.
+    After MAX_PASSES dots, which aren't decided, are left: the error is
+    only smaller with them.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    starts = np.asarray(starts, dtype=np.int64)
+    keep[starts] = True
+    keep[starts[1:] - 1] = True
+    keep[-1] = True
+    ends = np.flatnonzero(keep)
+    # dots inside segments, ends a, b of their segments, coordinates
+    live = np.flatnonzero(~keep)
+    right = np.searchsorted(ends, live)
+    a, b = ends[right - 1], ends[right]
+    columns = [np.ascontiguousarray(points[:, j], dtype=float)
+               for j in range(points.shape[1])]
+    inner = [column[live] for column in columns]
+    limit = tolerance * tolerance
+    for i in range(MAX_PASSES):
+        if not len(live):
+            break
+        # live dots are sorted, so dots of segment are one run
+        first = np.flatnonzero(np.concatenate(([True], a[1:] != a[:-1])))
+        counts = np.diff(np.append(first, len(live)))
+        length = np.zeros(len(first))
+        square = np.zeros(len(live))
+        proj = np.zeros(len(live))
+        for column, values in zip(columns, inner):
+            start = column[a[first]]
+            chord = column[b[first]] - start
+            length += chord * chord
+            d = values - np.repeat(start, counts)
+            square += d * d
+            proj += d * np.repeat(chord, counts)
+        # |inner x chord|^2 = |inner|^2 |chord|^2 - (inner . chord)^2
+        length = np.repeat(length, counts)
+        dist = square * length - proj * proj
+        np.divide(dist, length, out=dist, where=length > 0)
+        np.copyto(dist, square, where=length == 0)
+        # farthest dot of every segment (the first one of equal)
+        farthest = np.maximum.reduceat(dist, first)
+        segment = np.repeat(np.arange(len(first)), counts)
+        top = np.flatnonzero(dist == np.repeat(farthest, counts))
+        top = top[np.concatenate(([True], segment[top[1:]] !=
+                                  segment[top[:-1]]))]
+        split = top[farthest[segment[top]] > limit]
+        keep[live[split]] = True
+        # segments without split are done, others are two segments now
+        middle = np.full(len(first), -1, dtype=np.int64)
+        middle[segment[split]] = live[split]
+        m = np.repeat(middle, counts)
+        before = (m >= 0) & (live < m)
+        after = (m >= 0) & (live > m)
+        b = np.where(before, m, b)
+        a = np.where(after, m, a)
+        rest = np.flatnonzero(before | after)
+        live, a, b = live[rest], a[rest], b[rest]
+        inner = [values[rest] for values in inner]
+    keep[live] = True
+    return keep
+
+
+def corners(positions, eps=1e-3):
+    """ Return indexes of dots, which aren't inside straight lines """
+    d1 = positions[1:-1] - positions[:-2]
+    d2 = positions[2:] - positions[1:-1]
+    cross = np.sqrt((np.cross(d1, d2)**2).sum(axis=1))
+    norm = np.sqrt((d1**2).sum(axis=1) * (d2**2).sum(axis=1))
+    straight = (cross <= eps * norm) & ((d1 * d2).sum(axis=1) > 0)
+    keep = np.ones(len(positions), dtype=bool)
+    keep[1:-1] = ~straight
+    return np.flatnonzero(keep)
+
+
+def decimate(positions, tolerance):
+    """
+    Return indexes of dots, which are left after decimation.
+
+    Dots inside straight lines are removed at once, then every layer
+    (dots with the same Z) is decimated separately, so first and last
+    dots of layers are always left.
+    """
+    positions = np.asarray(positions)
+    if len(positions) < 3:
+        return np.arange(len(positions))
+    index = corners(positions)
+    points = positions[index]
+    z = points[:, 2]
+    starts = np.concatenate(([0], np.flatnonzero(z[1:] != z[:-1]) + 1))
+    return index[rdp(points, tolerance, starts)]
+
+
+def levels(positions, tolerances=TOLERANCES):
+    """
+    Return levels of detail: list of (tolerance, indexes of dots).
+
+    Every level is decimated from the previous one, the first level is
+    all dots.
+    """
+    index = np.arange(len(positions))
+    result = [(0., index)]
+    for tolerance in tolerances:
+        index = index[decimate(positions[index], tolerance)]
+        result.append((tolerance, index))
+    return result
@@ -1,17 +1,19 @@
 # main.py
 #!/usr/bin/python
+import os
 import sys
-import re
 import logging
 import gcode
+import tokenizer
+import cache
+import incremental
+from toolpath import Toolpath
 
 from pyqtgraph.Qt import QtGui, QtCore
 
+log = logging.getLogger(__name__)
 icons = {'icon': 'icons/icon.png', 'exit': 'icons/exit.png'}
-log = "log.log"
-logging.basicConfig(
-    format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
-    level=logging.DEBUG, filename=log)
+EDITOR_LIMIT = 64 * 1024 * 1024    # bigger files aren't loaded in editor
 
 
 class MainWindow(QtGui.QMainWindow):
@@ -33,6 +35,10 @@ class MainWindow(QtGui.QMainWindow):
         self.save = QtGui.QAction('Save as ..', self, shortcut='Ctrl+Shift+S',
                                   statusTip='Save file as ..',
                                   triggered=self.saveFile)
+        self.export = QtGui.QAction('Export toolpath ..', self,
+                                    shortcut='Ctrl+E',
+                                    statusTip='Save toolpath as binary file',
+                                    triggered=self.exportFile)
         self.exit = QtGui.QAction(QtGui.QIcon(icons['exit']), "Exit", self,
                                   shortcut='Ctrl+Q',
                                   statusTip='Exit application',
@@ -40,6 +46,9 @@ class MainWindow(QtGui.QMainWindow):
         self.check = QtGui.QAction('Check', self, shortcut="Ctrl+B",
                                    statusTip='Check code',
                                    triggered=self.check_func)
+        self.next_error = QtGui.QAction('Next error', self, shortcut="F8",
+                                        statusTip='Go to next invalid line',
+                                        triggered=self.nextError)
         self.del_com = QtGui.QAction('Delete all comments', self,
                                      statusTip='Delete all comments',
                                      triggered=self.delCom)
@@ -49,23 +58,30 @@ class MainWindow(QtGui.QMainWindow):
         self.draw = QtGui.QAction('Show process', self, shortcut="Ctrl+T",
                                   statusTip='Show process of drawing image',
                                   triggered=self.drawImage)
+        self.stop = QtGui.QAction('Stop', self, shortcut="Esc",
+                                  statusTip='Stop parsing',
+                                  triggered=self.cancelWorker)
 
         menubar = self.menuBar()
         fl = menubar.addMenu('&File')
         fl.addAction(self.open)
         fl.addAction(self.save)
+        fl.addAction(self.export)
         fl.addAction(self.exit)
         fl = menubar.addMenu('&Options')
         fl.addAction(self.check)
+        fl.addAction(self.next_error)
         fl.addAction(self.del_com)
         fl.addAction(self.draw)
         fl.addAction(self.show_image)
+        fl.addAction(self.stop)
 
         toolbar = self.addToolBar("Actions")
         toolbar.addAction(self.open)
         toolbar.addAction(self.save)
         toolbar.addAction(self.draw)
         toolbar.addAction(self.show_image)
+        toolbar.addAction(self.stop)
         toolbar.addAction(self.exit)
         # end
 
@@ -76,72 +92,290 @@ class MainWindow(QtGui.QMainWindow):
 
         self.editor = QtGui.QTextEdit()
         self.editor.setFont(font)
-        highlighter = MyHighlighter(self.editor, "Classic")
+        self.editor.textChanged.connect(self.textChanged)
+        self.path = None    # big file, which isn't loaded in editor
+        self.toolpath = None   # toolpath from binary file
+        self.worker = None
+        self.stopping = []   # stopped workers, which still run
+        self.errors = []   # diagnostics of the last check
+        self.view = None   # opengl.App, which follows cursor of editor
+        self.syncing = False   # cursor and image are being synchronized
+        self.document = incremental.Document()
+        self.document.set_text('')
+        self.blocks = self.editor.document().blockCount()
+        self.editor.document().contentsChange.connect(self.contentsChange)
+        self.editor.cursorPositionChanged.connect(self.cursorMoved)
+        self.highlighter = MyHighlighter(self.editor, "Classic")
         self.setCentralWidget(self.editor)
 
         self.statusBar().showMessage('Ready')
 
     def openFile(self):
         fl = QtGui.QFileDialog.getOpenFileName(self, 'Open file', './gcodes',
-                                               'Text Files (*.gcode *.txt)')
+                                               'Text Files (*.gcode *.txt);;'
+                                               'Toolpath Files (*.gtp)')
         if fl:
             try:
-                logging.debug('Open file: {}'.format(str(fl)))
-                self.editor.setText(open(fl).read())
-            except IOError:
-                logging.error('Try to open non-existent file')
+                log.debug('Open file: {}'.format(str(fl)))
+                if str(fl).endswith('.gtp'):
+                    toolpath = Toolpath.load(str(fl))
+                    self.editor.clear()
+                    self.path = None
+                    self.toolpath = toolpath
+                    self.statusBar().showMessage(
+                        'Toolpath file, only images are shown')
+                elif os.path.getsize(str(fl)) > EDITOR_LIMIT:
+                    self.editor.clear()
+                    self.toolpath = None
+                    self.path = str(fl)
+                    self.statusBar().showMessage(
+                        'File is too big for editor, only images are shown')
+                else:
+                    self.editor.setText(open(fl).read())
+            except (IOError, OSError):
+                log.error('Try to open non-existent file')
                 self.message('Error', 'Non-existent file')
+            except ValueError as e:
+                log.error(str(e))
+                self.message('Error', str(e))
         else:
-            logging.error('Try to open file with null filename')
+            log.error('Try to open file with null filename')
 
     def saveFile(self):
         fl = QtGui.QFileDialog.getSaveFileName(self, 'Save as', './gcodes',
                                                '*.gcode')
         if fl:
-            logging.debug('Save file: {}'.format(str(fl)))
+            log.debug('Save file: {}'.format(str(fl)))
             with open(fl, 'w') as f:
                 f.write(self.editor.toPlainText())
         else:
-            logging.error('Try to save file with null filename')
+            log.error('Try to save file with null filename')
+
+    def exportFile(self):
+        fl = QtGui.QFileDialog.getSaveFileName(self, 'Export toolpath',
+                                               './gcodes', '*.gtp')
+        if fl:
+            log.debug('Export toolpath: {}'.format(str(fl)))
+            self.startWorker(
+                lambda gc, toolpath: self.saveToolpath(toolpath, str(fl)))
+        else:
+            log.error('Try to export file with null filename')
+
+    def saveToolpath(self, toolpath, fl):
+        """ Save toolpath to file, show error, if it isn't saved """
+        error = gcode.save_toolpath(toolpath, fl)
+        if error:
+            self.message('Error', error)
 
     def closeEvent(self, event):
-        logging.debug('Closing main window...')
+        log.debug('Closing main window...')
         reply = QtGui.QMessageBox.question(self, 'Message',
                                            "Are you sure to quit?",
                                            QtGui.QMessageBox.No,
                                            QtGui.QMessageBox.Yes)
         if reply == QtGui.QMessageBox.Yes:
-            logging.debug('The end')
+            log.debug('The end')
+            self.cancelWorker()
+            for worker in self.stopping:   # cancelled, they stop soon
+                worker.wait()
             event.accept()
         else:
-            logging.debug('or not')
+            log.debug('or not')
             event.ignore()
 
+    def textChanged(self):
+        if (self.path or self.toolpath) and self.editor.toPlainText():
+            log.debug('Close file: {}'.format(self.path))
+            self.path = None
+            self.toolpath = None
+            self.statusBar().showMessage('Ready')
+
+    def contentsChange(self, position, removed, added):
+        """ Parse only changed lines of editor """
+        if self.highlighter.busy and removed == added:
+            return   # only formats are changed
+        self.cancelWorker()
+        doc = self.editor.document()
+        first = doc.findBlock(position).blockNumber()
+        end = min(position + added, doc.characterCount() - 1)
+        last = doc.findBlock(end).blockNumber()
+        count = doc.blockCount()
+        lines = [str(doc.findBlockByNumber(i).text())
+                 for i in range(first, last+1)]
+        self.document.update(first, len(lines) - (count - self.blocks), lines)
+        self.blocks = count
+
+    def gcode(self):
+        """ Return gcode from editor or from big file """
+        if self.path:
+            g = gcode.gcode.from_file(self.path)
+            g.spacing = 0   # only ends of moves, colors are interpolated
+            g.compact = True
+            g.processes = None   # parsed by all CPUs
+            return g
+        return gcode.gcode(str(self.editor.toPlainText()))
+
     def check_func(self):
-        valid = gcode.gcode(str(self.editor.toPlainText())).check()
-        message = valid and "Valid Gcode" or "Invalid Gcode"
-        logging.debug('Checked if Gcode is valid. Result - {}'.format(message))
+        self.errors = self.gcode().diagnostics()
+        message = self.errors and "Invalid Gcode" or "Valid Gcode"
+        log.debug('Checked if Gcode is valid. Result - {}'.format(message))
+        if not self.path:
+            self.underline(self.errors)
+        if self.errors:
+            self.goToError(self.errors[0])
+            message = '{}: {} error(s), the first one in {}'.format(
+                message, len(self.errors), self.errors[0])
         self.message("Result", message)
 
+    def underline(self, errors):
+        """ Underline diagnostics in editor by red wave """
+        doc = self.editor.document()
+        selections = []
+        for error in errors:
+            block = doc.findBlockByNumber(error.line)
+            selection = QtGui.QTextEdit.ExtraSelection()
+            selection.cursor = QtGui.QTextCursor(block)
+            selection.cursor.setPosition(
+                block.position() + min(error.column, block.length() - 1))
+            selection.cursor.setPosition(
+                block.position() + block.length() - 1,
+                QtGui.QTextCursor.KeepAnchor)
+            selection.format.setUnderlineStyle(
+                QtGui.QTextCharFormat.WaveUnderline)
+            selection.format.setUnderlineColor(QtGui.QColor('red'))
+            selections.append(selection)
+        self.editor.setExtraSelections(selections)
+
+    def goToError(self, error):
+        """ Move cursor of editor to diagnostic, show it in status bar """
+        self.statusBar().showMessage(str(error))
+        if self.path:
+            return
+        block = self.editor.document().findBlockByNumber(error.line)
+        cursor = self.editor.textCursor()
+        cursor.setPosition(block.position() +
+                           min(error.column, block.length() - 1))
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+
+    def nextError(self):
+        """ Go to the first error after cursor (or to the first one) """
+        if not self.errors:
+            self.statusBar().showMessage('No errors, check code first')
+            return
+        line = self.editor.textCursor().blockNumber()
+        following = [e for e in self.errors if e.line > line]
+        self.goToError((following or self.errors)[0])
+
     def delCom(self):
-        logging.debug('Delete comments from text')
+        log.debug('Delete comments from text')
         self.editor.setText(gcode.gcode(self.editor.toPlainText()).del_comm())
 
     def drawImage(self):
-        logging.debug('Show process of drawing image')
-        try:
-            if (str(self.editor.toPlainText())):
-                gcode.gcode(str(self.editor.toPlainText())).drawing()
-        except gcode.GcodeError as e:
-            self.message('Error', e.message)
+        log.debug('Show process of drawing image')
+        self.startWorker(lambda gc, toolpath: gc.drawing(toolpath))
 
     def showImage(self):
-        logging.debug('Show image')
+        log.debug('Show image')
+        self.startWorker(lambda gc, toolpath: gc.show_image(toolpath),
+                         levels=True)
+
+    def startWorker(self, show, levels=False):
+        """
+        Generate toolpath in background and give it to show; levels of
+        detail are built in background too, if levels is True
+        """
+        self.cancelWorker()
+        if self.toolpath is not None:
+            show(gcode.gcode(''), self.toolpath)   # nothing to parse
+            return
+        if self.path:
+            gc = self.gcode()
+            make = gc.get_toolpath
+        elif str(self.editor.toPlainText()):
+            gc = self.document.gcode
+            digest = gcode.digest(str(self.editor.toPlainText()))
+            make = lambda: self.document.toolpath(digest)
+        else:
+            return
+
+        def job():
+            toolpath = make()
+            if levels:
+                toolpath.levels   # they are cached with toolpath
+            return toolpath
+        worker = Worker(gc, job, self.stopping)
+        self.stopping = []
+        # signals of stopped workers are ignored (they may be queued)
+        worker.progressed.connect(
+            lambda lines, dots: self.progressed(worker, lines, dots))
+        worker.done.connect(
+            lambda toolpath: self.done(worker, show, gc, toolpath))
+        worker.failed.connect(lambda message: self.failed(worker, message))
+        self.worker = worker
+        worker.start()
+
+    def cancelWorker(self):
+        """ Stop worker without waiting: the next one waits for it """
+        if self.worker is not None and self.worker.isRunning():
+            log.debug('Stop parsing')
+            self.worker.cancel()
+            self.stopping.append(self.worker)
+            self.statusBar().showMessage('Stopped')
+        self.stopping = [w for w in self.stopping if w.isRunning()]
+        self.worker = None
+
+    def progressed(self, worker, lines, dots):
+        if worker is not self.worker:
+            return
+        self.statusBar().showMessage(
+            'Parsing: {} lines, {} dots'.format(lines, dots))
+
+    def done(self, worker, show, gc, toolpath):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.statusBar().showMessage('Ready')
+        view = show(gc, toolpath)
+        if hasattr(view, 'lineChanged'):   # opengl.App, not export
+            self.view = view
+            view.lineChanged.connect(self.followLine)
+
+    def followLine(self, line):
+        """ Move cursor of editor to line, which is drawn now """
+        if self.path or self.toolpath:
+            return   # lines aren't in editor
+        block = self.editor.document().findBlockByNumber(line)
+        if not block.isValid():
+            return
+        self.syncing = True
         try:
-            if (str(self.editor.toPlainText())):
-                gcode.gcode(str(self.editor.toPlainText())).show_image()
-        except gcode.GcodeError as e:
-            self.message('Error', e.message)
+            cursor = self.editor.textCursor()
+            cursor.setPosition(block.position())
+            self.editor.setTextCursor(cursor)
+            self.editor.ensureCursorVisible()
+        finally:
+            self.syncing = False
+        self.statusBar().showMessage('Line {}'.format(line + 1))
+
+    def cursorMoved(self):
+        """ Find line of cursor in image """
+        if self.syncing or self.view is None or not self.view.isVisible():
+            return
+        if self.path or self.toolpath:
+            return
+        self.syncing = True
+        try:
+            self.view.seek_line(self.editor.textCursor().blockNumber())
+        finally:
+            self.syncing = False
+
+    def failed(self, worker, message):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.statusBar().showMessage('Ready')
+        self.message('Error', message)
 
     def message(self, name, message):
         reply = QtGui.QMessageBox.question(self, name, message,
@@ -149,13 +383,85 @@ class MainWindow(QtGui.QMainWindow):
         return reply
 
 
-class HighlightingRule(object):
-    def __init__(self, pattern, format_):
-        self.pattern = pattern
-        self.format_ = format_
+class Cancelled(Exception):
+    """ Exception for stopped parsing """
+
+
+class Worker(QtCore.QThread):
+    """
+    Thread, which generates toolpath in background
+
+    Parameters
+    ----------
+    settings : gcode.gcode
+        Gcode, which reports progress of job.
+    job : function
+        Return toolpath.
+    previous : list of Worker
+        Stopped workers, which may still run: job starts after them, so
+        GUI thread never waits and jobs never share settings.
+    """
+    progressed = QtCore.Signal(int, int)   # lines, dots
+    done = QtCore.Signal(object)   # toolpath
+    failed = QtCore.Signal(str)   # error message
+
+    def __init__(self, settings, job, previous=()):
+        QtCore.QThread.__init__(self)
+        self.settings = settings
+        self.job = job
+        self.previous = list(previous)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def progress(self, lines, dots):
+        if self.cancelled:
+            raise Cancelled()
+        self.progressed.emit(lines, dots)
+
+    def run(self):
+        for worker in self.previous:
+            worker.wait()
+        self.previous = []
+        if self.cancelled:
+            return
+        self.settings.progress = self.progress
+        try:
+            toolpath = self.job()
+        except Cancelled:
+            log.debug('Parsing is stopped')
+        except gcode.GcodeError as e:
+            self.failed.emit(e.message)
+        except Exception as e:   # thread must not die silently
+            log.exception('Toolpath is not generated')
+            self.failed.emit('{}: {}'.format(type(e).__name__, e))
+        else:
+            if not self.cancelled:
+                self.done.emit(toolpath)
+        finally:
+            self.settings.progress = None
+
+
+class Pending(QtGui.QTextBlockUserData):
+    """ Flag of block, which isn't highlighted yet (see MyHighlighter) """
+    def __init__(self):
+        QtGui.QTextBlockUserData.__init__(self)
+        self.pending = True
 
 
 class MyHighlighter(QtGui.QSyntaxHighlighter):
+    """
+    Highlighter, which scans every line once with tokenizer.
+
+    Only blocks near viewport are highlighted at once, the others are
+    highlighted later in idle time (by {BATCH} blocks). Such blocks are
+    marked by Pending data, state of every block is 0: a changed state
+    would make Qt highlight the next block too, up to the end of text.
+    """
+    MARGIN = 50
+    BATCH = 500
+
     def __init__(self, parent, theme):
         QtGui.QSyntaxHighlighter.__init__(self, parent)
         self.parent = parent
@@ -164,75 +470,127 @@ class MyHighlighter(QtGui.QSyntaxHighlighter):
         coor = QtGui.QTextCharFormat()
         comment = QtGui.QTextCharFormat()
         feedrate = QtGui.QTextCharFormat()
-        error = QtGui.QTextCharFormat()
-
-        self.highlightingRules = []
+        self.error = QtGui.QTextCharFormat()
 
         # main_command or tech_command (G1 M107)
         brush = QtGui.QBrush(QtCore.Qt.darkBlue, QtCore.Qt.SolidPattern)
         main_command.setForeground(brush)
         main_command.setFontWeight(QtGui.QFont.Bold)
-        pattern = re.compile("\\b[GM][0-9]{1,3}\\b")
-        rule = HighlightingRule(pattern, main_command)
-        self.highlightingRules.append(rule)
 
         # line (N10)
         brush = QtGui.QBrush(QtCore.Qt.darkMagenta, QtCore.Qt.SolidPattern)
         line.setForeground(brush)
-        pattern = re.compile("\\bN[0-9]+\\b")
-        rule = HighlightingRule(pattern, line)
-        self.highlightingRules.append(rule)
 
         # coordinates (X10.5 or Y5)
         brush = QtGui.QBrush(QtCore.Qt.darkCyan)
         coor.setForeground(brush)
-        pattern = re.compile("\\b[XYZ][-+]?[0-9]+(\.[0-9]+)?\\b")
-        rule = HighlightingRule(pattern, coor)
-        self.highlightingRules.append(rule)
 
         # comment (; .... blah blah)
         brush = QtGui.QBrush(QtCore.Qt.darkYellow)
         comment.setForeground(brush)
-        pattern = re.compile(";\s.*")
-        rule = HighlightingRule(pattern, comment)
-        self.highlightingRules.append(rule)
 
         # feedrate (F160.0)
         brush = QtGui.QBrush(QtCore.Qt.darkGreen)
         feedrate.setForeground(brush)
-        pattern = re.compile("\\b[F][-+]?[0-9]+(\.[0-9]+)?\\b")
-        rule = HighlightingRule(pattern, feedrate)
-        self.highlightingRules.append(rule)
 
         # error
         brush = QtGui.QBrush(QtCore.Qt.red)
-        error.setForeground(brush)
-        # this pattern finds correct string
-        pattern = re.compile('^(((?!;)[A-Z][+-]?\d+(\.\d+)?\s?)*(\s*;\s.*)?)$')
-        self.rule = HighlightingRule(pattern, error)
+        self.error.setForeground(brush)
+
+        self.formats = {'G': main_command, 'M': main_command, 'N': line,
+                        'X': coor, 'Y': coor, 'Z': coor, 'F': feedrate,
+                        ';': comment}
+
+        self.busy = False   # highlight all blocks
+        self.first = self.last = 0   # blocks in viewport
+        self.next = 0   # first block, which isn't highlighted
+        self.highlighted = 0   # blocks, which are highlighted while busy
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.idle)
+        parent.verticalScrollBar().valueChanged.connect(self.scrolled)
+
+    def viewport(self):
+        """ Update numbers of blocks in viewport """
+        editor = self.parent
+        bottom = QtCore.QPoint(0, editor.viewport().height())
+        self.first = editor.cursorForPosition(
+            QtCore.QPoint(0, 0)).blockNumber()
+        self.last = editor.cursorForPosition(bottom).blockNumber()
+
+    def scrolled(self, value):
+        """ Highlight blocks, which become visible """
+        self.viewport()
+        doc = self.document()
+        block = doc.findBlockByNumber(max(self.first - self.MARGIN, 0))
+        self.busy = True
+        while block.isValid() and block.blockNumber() <= self.last:
+            if self.pending(block):
+                self.rehighlightBlock(block)
+            block = block.next()
+        self.busy = False
+
+    @staticmethod
+    def pending(block):
+        """ Return True, if block isn't highlighted yet """
+        data = block.userData()
+        return data is not None and data.pending
+
+    def idle(self):
+        """ Highlight next {BATCH} blocks, which aren't highlighted """
+        block = self.document().findBlockByNumber(self.next)
+        self.busy = True
+        self.highlighted = 0
+        for i in range(self.BATCH):
+            if not block.isValid():
+                self.timer.stop()
+                break
+            if self.highlighted >= self.BATCH:
+                break   # never more than BATCH blocks at once
+            if self.pending(block):
+                self.rehighlightBlock(block)
+            block = block.next()
+        if block.isValid():
+            self.next = block.blockNumber()
+        self.busy = False
 
     def highlightBlock(self, text):
-        for rule in self.highlightingRules:
-            exp = rule.pattern
-            result = exp.search(text, 0)
-            while result:
-                span = result.span()
-                length = span[1] - span[0]
-                self.setFormat(span[0], length, rule.format_)
-                result = exp.search(text, span[0]+length)
-
-        exp = self.rule.pattern
-        result = exp.search(text, 0)
-        if not(result):
-            self.setFormat(0, len(text), self.rule.format_)
-
-        self.setCurrentBlockState(0)
+        n = self.currentBlock().blockNumber()
+        self.setCurrentBlockState(0)   # the same for all blocks
+        data = self.currentBlockUserData()
+        if not(self.busy or
+               self.first - self.MARGIN <= n <= self.last + self.MARGIN):
+            if data is None:
+                self.setCurrentBlockUserData(Pending())   # later
+            else:
+                data.pending = True
+            if not self.timer.isActive() or n < self.next:
+                self.next = n
+                self.timer.start()
+            return
+        if data is not None:
+            data.pending = False
+        self.highlighted += 1
+
+        spans = tokenizer.spans(str(text))
+        if spans is None:
+            self.setFormat(0, len(text), self.error)
+        else:
+            for start, end, kind in spans:
+                if kind in self.formats:
+                    self.setFormat(start, end - start, self.formats[kind])
 
 
 if __name__ == "__main__":
-    with open(log, 'w') as f:
+    logfile = "log.log"
+    logging.basicConfig(
+        format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
+        level=logging.DEBUG, filename=logfile)
+
+    with open(logfile, 'w') as f:
         pass
     logging.debug('Program starts')
+    gcode.gcode.cache = cache.Cache()
     app = QtGui.QApplication(sys.argv)
     main = MainWindow()
     main.show()
@@ -2,79 +2,312 @@
 #!/usr/bin/python
 import sys
 import logging
+import numpy as np
 import pyqtgraph.opengl as gl
+import instrument
 
+from OpenGL.GL import (glLineWidth, glEnableClientState, glVertexPointer,
+                       glColorPointer, glDrawArrays, glDisableClientState,
+                       GL_VERTEX_ARRAY, GL_COLOR_ARRAY, GL_FLOAT,
+                       GL_LINE_STRIP)
+from OpenGL.arrays import vbo
 from pyqtgraph.Qt import QtGui, QtCore
 
 
-log = "log.log"
-logging.basicConfig(
-    format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
-    level=logging.DEBUG, filename=log)
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+RATE = 2000   # dots per second
+
+
+class PathItem(gl.GLGraphicsItem):
+    """
+    Line strip, which is uploaded to GPU once
+
+    Only {count} dots from {first} are drawn, so drawing of image step by
+    step or by layers doesn't upload dots again.
+    """
+    def __init__(self, pos, color, width=1.0):
+        gl.GLGraphicsItem.__init__(self)
+        self.pos = vbo.VBO(np.ascontiguousarray(pos, dtype=np.float32))
+        self.color = vbo.VBO(np.ascontiguousarray(color, dtype=np.float32))
+        self.total = len(pos)
+        self.uploaded = False
+        self.first = 0
+        self.count = self.total
+        self.width = width
+
+    def setCount(self, count):
+        """ Draw only the first {count} dots """
+        self.count = max(0, min(int(count), self.total - self.first))
+        self.update()
+
+    def setRange(self, first, last):
+        """ Draw only dots [first, last) """
+        self.first = max(0, min(int(first), self.total))
+        self.setCount(last - self.first)
+
+    def upload(self):
+        """ Copy dots to GPU (VBO copies data on the first bind) """
+        with instrument.stage('GL upload') as stage:
+            for buf in (self.pos, self.color):
+                buf.bind()
+                buf.unbind()
+            stage.points = self.total
+        self.uploaded = True
+
+    def paint(self):
+        if self.count < 2:
+            return
+        if not self.uploaded:
+            self.upload()
+        self.setupGLState()
+        glLineWidth(self.width)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        try:
+            self.pos.bind()
+            glVertexPointer(3, GL_FLOAT, 0, self.pos)
+            self.color.bind()
+            glColorPointer(4, GL_FLOAT, 0, self.color)
+            glDrawArrays(GL_LINE_STRIP, self.first, self.count)
+        finally:
+            self.color.unbind()
+            self.pos.unbind()
+            glDisableClientState(GL_COLOR_ARRAY)
+            glDisableClientState(GL_VERTEX_ARRAY)
 
 
 class App(gl.GLViewWidget):
-    def __init__(self, data, colors, time=0):
+    """
+    Window with image of gcode
+
+    Parameters
+    ----------
+    data, colors : arrays
+        Positions and colors of dots.
+    time : int
+        Interval of timer in ms.
+    offset : array_like
+        Translation of dots.
+    rate : float
+        Dots per second for drawing of image.
+    starts : array of dtype int or None
+        Indexes of first dots of moves; if it's given, rate is moves
+        per second.
+    levels : list or None
+        Levels of detail from lod.levels; they are used only for the
+        whole image, the coarsest level, which error is less than one
+        pixel, is drawn.
+    layers : layers.Layers or None
+        Index of layers of dots.
+    sourcemap : sourcemap.SourceMap or None
+        Index of source lines of dots; with it lineChanged is emitted,
+        while image is drawn, and seek_line finds line.
+
+    Notes
+    -----
+    Space - pause, Esc - close, Left/Right - one second back/forward,
+    PageUp/PageDown - ten seconds, Home/End - beginning/end of image,
+    Up/Down - next/previous layer (only this layer, if image isn't drawn).
+    """
+    lineChanged = QtCore.Signal(int)   # source line of the last drawn dot
+
+    def __init__(self, data, colors, time=0, offset=(0, 0, 0), rate=RATE,
+                 starts=None, levels=None, layers=None, sourcemap=None):
         gl.GLViewWidget.__init__(self)
         self.data = data
         self.colors = colors
         self.time = time
-        self.n = 0
+        self.rate = float(rate)
+        self.starts = starts
+        self.layers = layers
+        self.sourcemap = sourcemap
+        self.line = None   # source line of the last drawn dot
+        self.layer = None   # the only shown layer
+        self.n = 0.   # position of drawing (dots or moves)
         self.run = 0
+        self.clock = QtCore.QElapsedTimer()
 
         self.setCameraPosition(distance=150)
         self.setWindowTitle('G-codes')
 
-        self.plt = gl.GLLinePlotItem()
+        self.plt = PathItem(data, colors)
+        self.plt.translate(*offset)
         self.addItem(self.plt)
+        self.levels = []   # (tolerance, item), from fine to coarse
+        for tolerance, index in (levels or [])[1:]:
+            item = PathItem(data[index], colors[index])
+            item.translate(*offset)
+            item.setVisible(False)
+            self.addItem(item)
+            self.levels.append((tolerance, item))
+        self.lod = False
+        self.marker = gl.GLScatterPlotItem(pos=np.zeros((1, 3)),
+                                           color=(1., 1., 0., 1.), size=8)
+        self.marker.translate(*offset)
+        self.marker.setVisible(False)
+        self.addItem(self.marker)
 
         self.timer = QtCore.QTimer()
         self.connect(self.timer, QtCore.SIGNAL("timeout()"),
                      self.draw_image)
 
+    @property
+    def length(self):
+        """ Return number of dots or moves """
+        if self.starts is not None:
+            return len(self.starts)
+        return len(self.data)
+
     def show_image(self):
-        self.plt.setData(pos=self.data, color=self.colors)
+        self.plt.setRange(0, len(self.data))
+        self.layer = None
+        self.lod = bool(self.levels)
         self.show()
 
+    def show_layers(self, first, last=None):
+        """ Show only layers [first, last] """
+        first = max(0, min(first, len(self.layers) - 1))
+        if last is None:
+            last = first
+        part = self.layers.dots(first, last)
+        self.layer = first if first == last else None
+        self.plt.setRange(part.start, part.stop)
+        self.lod = False
+        self.choose_level(None)
+
     def drawing(self):
-        logging.debug('Start drawing')
+        log.debug('Start drawing')
+        self.lod = False
+        self.choose_level(None)
+        self.seek(0)
         self.show()
+        self.clock.start()
         self.timer.start(self.time)
         self.run = 1
 
+    def dot(self, n=None):
+        """ Return number of dots, which are drawn up to position n """
+        n = int(self.n if n is None else n)
+        if self.starts is not None:
+            n = len(self.data) if n >= len(self.starts) else self.starts[n]
+        return int(n)
+
+    def position(self, dot):
+        """ Return position of drawing (dot or move), which gives dot """
+        if self.starts is not None:
+            return int(np.searchsorted(self.starts, dot))
+        return dot
+
+    def seek(self, n):
+        """ Show image up to dot (or move) n """
+        self.n = max(0., min(float(n), self.length))
+        dot = self.dot()
+        self.plt.setRange(0, dot)
+        if self.sourcemap is not None and len(self.sourcemap):
+            line = self.sourcemap.line_of_dot(max(dot - 1, 0))
+            self.mark(max(dot - 1, 0))
+            if line != self.line:
+                self.line = line
+                self.lineChanged.emit(line)
+
+    def seek_layer(self, layer):
+        """ Draw image up to the beginning of layer """
+        layer = max(0, min(layer, len(self.layers) - 1))
+        self.seek(self.position(self.layers.starts[layer]))
+
+    def seek_line(self, line):
+        """
+        Find source line: drawing goes to the end of its dots, the whole
+        image only marks it
+        """
+        if self.sourcemap is None or not len(self.sourcemap):
+            return
+        part = self.sourcemap.dots_of_line(line)
+        if self.timer.isActive():
+            self.seek(self.position(part.stop))
+        self.mark(min(part.start, len(self.data) - 1))
+
+    def mark(self, dot):
+        """ Show marker on dot """
+        self.marker.setData(pos=np.asarray(self.data[dot:dot+1],
+                                           dtype=np.float32))
+        self.marker.setVisible(True)
+
+    def current_layer(self):
+        """ Return number of the last drawn layer """
+        return self.layers.layer_of_dot(max(self.dot() - 1, 0))
+
+    def pixel_size(self):
+        """ Return size of one pixel in the center of view """
+        height = max(self.height(), 1)
+        fov = np.radians(self.opts['fov'])
+        return 2 * self.opts['distance'] * np.tan(fov / 2) / height
+
+    def choose_level(self, size):
+        """ Show the coarsest level with error less than size """
+        chosen = self.plt
+        if size is not None:
+            for tolerance, item in self.levels:
+                if tolerance <= size:
+                    chosen = item
+        self.plt.setVisible(chosen is self.plt)
+        for tolerance, item in self.levels:
+            item.setVisible(item is chosen)
+
+    def paintGL(self, *args, **kwds):
+        if self.lod:
+            self.choose_level(self.pixel_size())
+        gl.GLViewWidget.paintGL(self, *args, **kwds)
+
     def draw_image(self):
-        if self.run:
-            if self.n > len(self.data):
-                pass
-            else:
-                if self.n % 1000 == 0 and self.n:
-                    logging.debug("drawed {} dots".format(self.n))
-                self.n += 1
-                self.plt.setData(pos=self.data[:self.n],
-                                 color=self.colors[:self.n])
+        elapsed = self.clock.restart() / 1000.
+        if self.run and self.n < self.length:
+            self.seek(self.n + elapsed * self.rate)
 
     def keyPressEvent(self, event):
-        if event.key() == QtCore.Qt.Key_Space:
-            logging.debug("Pause drawing")
+        key = event.key()
+        steps = {QtCore.Qt.Key_Left: -1, QtCore.Qt.Key_Right: 1,
+                 QtCore.Qt.Key_PageUp: -10, QtCore.Qt.Key_PageDown: 10}
+        if key == QtCore.Qt.Key_Space:
+            log.debug("Pause drawing")
             self.run = not(self.run)
-        elif event.key() == QtCore.Qt.Key_Escape:
-            logging.debug("Press esc")
+        elif key == QtCore.Qt.Key_Escape:
+            log.debug("Press esc")
             self.timer.stop()
             self.close()
+        elif key in steps:
+            self.seek(self.n + steps[key] * self.rate)
+        elif key == QtCore.Qt.Key_Home:
+            self.seek(0)
+        elif key == QtCore.Qt.Key_End:
+            self.seek(self.length)
+        elif key in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down) and self.layers:
+            step = 1 if key == QtCore.Qt.Key_Up else -1
+            if self.timer.isActive():
+                self.seek_layer(self.current_layer() + step)
+            elif self.layer is None:
+                self.show_layers(0 if step > 0 else len(self.layers) - 1)
+            else:
+                self.show_layers(self.layer + step)
         else:
-            logging.debug("Press key: "+str(event.key()))
+            log.debug("Press key: "+str(event.key()))
 
     def closeEvent(self, event):
-        logging.debug("Quit")
+        log.debug("Quit")
         self.timer.stop()
         event.accept()
 
 
 if __name__ == "__main__":
-    import numpy as np
     from gradient import main as grad
 
-    with open(log, 'w') as f:
+    logfile = "log.log"
+    logging.basicConfig(
+        format='%(filename)s[LINE:%(lineno)d]# %(levelname)-8s %(message)s',
+        level=logging.DEBUG, filename=logfile)
+
+    with open(logfile, 'w') as f:
         pass
     logging.debug('Test file')
     dots = np.array(([0, 0, 0],
@@ -87,7 +320,7 @@ if __name__ == "__main__":
                     [6, 0, 0]))
     colors = np.array(grad(n=8))
     a = QtGui.QApplication(sys.argv)
-    app = App(dots, colors, 1000)
-    app.main()
+    app = App(dots, colors, rate=1)
+    app.drawing()
     a.exec_()
     logging.debug('Test ends')
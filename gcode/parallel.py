@@ -0,0 +1,110 @@
+# parallel.py
+#!/usr/bin/python
+import os
+from multiprocessing import Pool
+import numpy as np
+import tokenizer
+
+
+CHUNK_SIZE = 16 * 1024 * 1024   # bytes of file in one task
+CHUNK_LINES = 200000   # lines of text in one task
+
+
+def file_chunks(path, size=None):
+    """
+    Return (start, end) offsets of parts of file (by {CHUNK_SIZE} bytes),
+    which end by line
+    """
+    if size is None:
+        size = CHUNK_SIZE
+    total = os.path.getsize(path)
+    chunks = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < total:
+            f.seek(min(start + size, total))
+            f.readline()
+            end = min(f.tell(), total)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_chunk(task):
+    """
+    Return moves of one part of gcode.
+
+    Parameters
+    ----------
+    task : tuple
+        (path, start, end) of file or (lines,).
+
+    Returns
+    -------
+    (moves, count, error) : tuple
+        Moves with line numbers from the beginning of part, number of
+        lines and (line, text) of the first invalid line or None.
+    """
+    if len(task) == 3:
+        lines = tokenizer.FileLines(*task)
+    else:
+        lines = task[0]
+    arrays = []
+    count = 0
+    try:
+        for block in tokenizer.blocks(lines):
+            arrays.append(block.motions())
+            count += block.count
+    except tokenizer.TokenizeError as e:
+        return np.empty((0, tokenizer.WIDTH)), count, (e.line, e.text)
+    if not arrays:
+        return np.empty((0, tokenizer.WIDTH)), count, None
+    return np.concatenate(arrays), count, None
+
+
+def move_array(blocks, processes=None, progress=None):
+    """
+    Return moves of gcode like gcode.move_array, parsed in process pool.
+
+    Parameters
+    ----------
+    blocks : list of strings or tokenizer.FileLines
+        Lines of gcode.
+    processes : int
+        Number of processes, by default number of CPUs.
+    progress : function or None
+        Called with number of parsed lines after every part.
+
+    Notes
+    -----
+    Parts are parsed separately, so line numbers start from 0 in every
+    part: they are shifted by prefix sums of numbers of lines. Modal
+    values and distance modes aren't filled here, gcode.fill_moves fills
+    them over all moves at once, so the result is identical to parsing in
+    one process.
+    """
+    if isinstance(blocks, tokenizer.FileLines):
+        tasks = [(blocks.path, start, end)
+                 for start, end in file_chunks(blocks.path)]
+    else:
+        tasks = [(blocks[i:i+CHUNK_LINES],)
+                 for i in range(0, len(blocks), CHUNK_LINES)]
+
+    arrays = []
+    first = 0   # number of the first line of part
+    pool = Pool(processes)
+    try:
+        for moves, count, error in pool.imap(parse_chunk, tasks):
+            if error is not None:
+                raise tokenizer.TokenizeError(first + error[0], error[1])
+            moves[:, 4] += first
+            arrays.append(moves)
+            first += count
+            if progress is not None:
+                progress(first, 0)
+    finally:
+        pool.terminate()
+        pool.join()
+    if not arrays:
+        return np.empty((0, tokenizer.WIDTH))
+    return np.concatenate(arrays)
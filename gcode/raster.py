@@ -0,0 +1,276 @@
+# raster.py
+#!/usr/bin/python
+"""
+Software rasterizer of toolpaths: PNG and animated GIF without OpenGL.
+
+Lines between dots of toolpath are sampled by pixels (DDA) with NumPy,
+the nearest sample of every pixel wins (z-buffer by sorting), colors
+are the ones of toolpath (gradient of feedrate). Only numpy, zlib and
+struct are used, so it works on servers without GPU and display.
+"""
+import zlib
+import struct
+import numpy as np
+import instrument
+
+
+VIEWS = ('top', 'iso', 'layer')
+SIZE = 256   # pixels
+MARGIN = 4   # pixels
+BACKGROUND = (255, 255, 255)
+DELAY = 10   # 1/100 s between frames of GIF
+# rows of projection: right, up and to viewer
+PROJECTIONS = {
+    'top': np.eye(3),
+    'iso': np.array([[1 / 2**.5, 1 / 2**.5, 0],
+                     [-1 / 6**.5, 1 / 6**.5, 2 / 6**.5],
+                     [1 / 3**.5, -1 / 3**.5, 1 / 3**.5]]),
+}
+PROJECTIONS['layer'] = PROJECTIONS['top']
+
+
+class Raster(object):
+    """
+    Class for samples of toolpath on image: pixel, depth, dot and step
+
+    Samples are found once, so frames of animation cost only sorting.
+
+    Parameters
+    ----------
+    toolpath : toolpath.Toolpath
+        Dots to draw, lines go from every dot to the next one.
+    size : int or (int, int)
+        Width and height of image.
+    view : string
+        'top', 'iso' or 'layer' (top view of one layer).
+    layer : int or None
+        Layer of 'layer' view, by default the last one with more than one
+        source line (not the last lift of nozzle).
+    background : (int, int, int)
+        Color of background.
+    """
+    def __init__(self, toolpath, size=SIZE, view='top', layer=None,
+                 background=BACKGROUND):
+        if view not in VIEWS:
+            raise ValueError('Unknown view {!r}, views: {}'.format(
+                view, ', '.join(VIEWS)))
+        if view == 'layer' and len(toolpath):
+            if layer is None:   # the last one, which isn't only a lift
+                layers = toolpath.layers
+                some = np.flatnonzero(layers.last_lines - layers.first_lines
+                                      > 1)
+                layer = int(some[-1]) if len(some) else len(layers) - 1
+            toolpath = toolpath.layer(layer)
+        self.width, self.height = ((size, size) if np.isscalar(size)
+                                   else size)
+        self.background = np.asarray(background, dtype=np.uint8)
+        with instrument.stage('rasterize') as stage:
+            self.sample(np.asarray(toolpath.positions, dtype=np.float64),
+                        np.asarray(toolpath.colors), PROJECTIONS[view])
+            stage.points = len(self.pixels)
+
+    def sample(self, positions, colors, projection):
+        """ Find pixels, depths and dots of samples of lines """
+        view = positions.dot(projection.T)
+        n = len(view)
+        # colors of dots on background, samples take them from dots
+        alpha = colors[:, 3:4]
+        self.rgb = colors[:, :3] * 255 * alpha + self.background * (1 - alpha)
+        if n == 0:
+            self.pixels = np.zeros(0, dtype=np.int64)
+            self.depths = np.zeros(0)
+            self.dots = np.zeros(0, dtype=np.int64)
+            self.steps = np.zeros(0)
+            return
+        low = view[:, :2].min(axis=0)
+        span = np.maximum(view[:, :2].max(axis=0) - low, 1e-9)
+        scale = min((self.width - 1 - 2 * MARGIN) / span[0],
+                    (self.height - 1 - 2 * MARGIN) / span[1])
+        scale = max(scale, 0)
+        # centered on image, rows go down
+        middle = low + span / 2
+        x = (self.width - 1) / 2. + (view[:, 0] - middle[0]) * scale
+        y = (self.height - 1) / 2. - (view[:, 1] - middle[1]) * scale
+
+        # every line from dot i to dot i+1 has one sample per pixel of its
+        # longer side, the last dot is a sample of its own
+        dx = np.concatenate((np.diff(x), [0.]))
+        dy = np.concatenate((np.diff(y), [0.]))
+        counts = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+        np.maximum(counts, 1, out=counts)
+        dot = np.repeat(np.arange(n), counts)
+        first = np.cumsum(counts) - counts
+        t = np.arange(len(dot), dtype=np.float64)
+        t -= first[dot]
+        t /= counts[dot]
+        px = np.rint(x[dot] + t * dx[dot]).astype(np.int64)
+        py = np.rint(y[dot] + t * dy[dot]).astype(np.int64)
+        self.pixels = py * self.width + px
+        z = view[:, 2]
+        self.depths = z[dot] + t * np.concatenate((np.diff(z), [0.]))[dot]
+        self.dots = dot
+        self.steps = t
+
+    def image(self, dots=None):
+        """
+        Return image of dots [0, dots) (all by default)
+
+        Returns
+        -------
+        image : array of dtype uint8, shape (height, width, 3)
+        """
+        size = self.width * self.height
+        flat = np.empty((size, 3), dtype=np.uint8)
+        flat[:] = self.background
+        samples = np.arange(len(self.pixels))
+        if dots is not None:
+            samples = samples[self.dots < dots]
+        pixels, depths = self.pixels[samples], self.depths[samples]
+        # z-buffer: the nearest samples of every pixel, then the last drawn
+        nearest = np.full(size, -np.inf)
+        np.maximum.at(nearest, pixels, depths)
+        front = depths == nearest[pixels]
+        last = np.full(size, -1)
+        np.maximum.at(last, pixels[front], samples[front])
+        shown = np.flatnonzero(last >= 0)
+        sample = last[shown]
+        dot = self.dots[sample]
+        following = np.minimum(dot + 1, len(self.rgb) - 1)
+        t = self.steps[sample, None]
+        rgb = self.rgb[dot] + t * (self.rgb[following] - self.rgb[dot])
+        flat[shown] = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+        return flat.reshape(self.height, self.width, 3)
+
+    def frames(self, count):
+        """ Return list of {count} images of drawing, the last is whole """
+        total = self.dots[-1] + 1 if len(self.dots) else 0
+        limits = np.linspace(0, total, count + 1)[1:]
+        return [self.image(int(np.ceil(limit))) for limit in limits]
+
+
+def chunk(kind, data):
+    """ Return PNG chunk """
+    return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+def write_png(image, fl):
+    """ Write RGB image (array of dtype uint8, shape (h, w, 3)) to file """
+    image = np.asarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)   # filter 0
+    rows[:, 1:] = image.reshape(height, -1)
+    fl.write(b'\x89PNG\r\n\x1a\n')
+    fl.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                        0, 0, 0)))
+    fl.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+    fl.write(chunk(b'IEND', b''))
+
+
+def palette(images):
+    """
+    Return palette (array of shape (k, 3), k <= 256) and indexes of
+    pixels of images in it
+
+    Low bits of colors are dropped, while there are more than 256 colors.
+    """
+    rgb = np.asarray(images, dtype=np.uint32)
+    for shift in range(8):
+        q = rgb >> shift
+        codes = (q[..., 0] << 16) | (q[..., 1] << 8) | q[..., 2]
+        colors, index = np.unique(codes.ravel(), return_inverse=True)
+        if len(colors) <= 256:
+            break
+    table = np.column_stack((colors >> 16, (colors >> 8) & 255,
+                             colors & 255)) << shift
+    table |= (1 << shift) >> 1   # middle of dropped range
+    return table.astype(np.uint8), index.reshape(codes.shape)
+
+
+def lzw(indexes, bits):
+    """ Return GIF LZW data of indexes with minimal code size {bits} """
+    clear = 1 << bits
+    size = bits + 1
+    table = {}
+    following = clear + 2
+    codes = [clear]
+    sizes = [size]
+    data = bytearray(np.asarray(indexes, dtype=np.uint8).tobytes())
+    prefix = data[0] if data else None
+    for byte in data[1:]:
+        key = prefix << 8 | byte
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        codes.append(prefix)
+        sizes.append(size)
+        if following < 4096:
+            table[key] = following
+            following += 1
+            if following > 1 << size and size < 12:
+                size += 1
+        else:   # table is full, start again
+            codes.append(clear)
+            sizes.append(size)
+            table.clear()
+            following = clear + 2
+            size = bits + 1
+        prefix = byte
+    if prefix is not None:
+        codes.append(prefix)
+        sizes.append(size)
+    codes.append(clear + 1)
+    sizes.append(size)
+    # codes are packed from the least significant bit: bits of every
+    # byte are reversed for np.packbits, which begins from the most one
+    codes = np.array(codes, dtype=np.int64)
+    sizes = np.array(sizes)
+    places = np.arange(12)
+    bits = ((codes[:, None] >> places) & 1)[places < sizes[:, None]]
+    bits = np.concatenate((bits, np.zeros(-len(bits) % 8, dtype=np.int64)))
+    return np.packbits(bits.astype(np.uint8).reshape(-1, 8)[:, ::-1]).tobytes()
+
+
+def write_gif(images, fl, delay=DELAY):
+    """ Write RGB images as animated GIF (looped), delay in 1/100 s """
+    table, indexes = palette(images)
+    height, width = indexes.shape[1:]
+    bits = max(int(len(table) - 1).bit_length(), 1)
+    colors = np.zeros((1 << bits, 3), dtype=np.uint8)
+    colors[:len(table)] = table
+    fl.write(b'GIF89a' + struct.pack('<HHBBB', width, height,
+                                     0x80 | (bits - 1) << 4 | (bits - 1),
+                                     0, 0))
+    fl.write(colors.tobytes())
+    fl.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')   # loop
+    minimal = max(bits, 2)
+    for frame in indexes.astype(np.uint8):
+        fl.write(b'\x21\xf9\x04\x00' + struct.pack('<H', delay) + b'\x00\x00')
+        fl.write(b'\x2c' + struct.pack('<HHHHB', 0, 0, width, height, 0))
+        data = lzw(frame, minimal)
+        fl.write(struct.pack('B', minimal))
+        for i in range(0, len(data), 255):
+            block = data[i:i+255]
+            fl.write(struct.pack('B', len(block)) + block)
+        fl.write(b'\x00')
+    fl.write(b'\x3b')
+
+
+def save(toolpath, path, size=SIZE, view='top', layer=None, frames=0,
+         background=BACKGROUND, delay=DELAY):
+    """
+    Render toolpath to file: PNG, or GIF of {frames} steps of drawing.
+
+    GIF with frames=0 has one frame.
+    """
+    raster = Raster(toolpath, size, view, layer, background)
+    gif = path.lower().endswith('.gif')
+    with instrument.stage('encode') as stage, open(path, 'wb') as fl:
+        if gif:
+            images = raster.frames(frames) if frames else [raster.image()]
+            write_gif(images, fl, delay)
+        else:
+            write_png(raster.image(), fl)
+        stage.points = raster.width * raster.height
+    return raster
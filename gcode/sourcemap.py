@@ -0,0 +1,85 @@
+# sourcemap.py
+#!/usr/bin/python
+import numpy as np
+
+
+class SourceMap(object):
+    """
+    Index of moves of toolpath: source line and dots of every move
+
+    Attributes
+    ----------
+    lines : array of dtype int64, shape (m,)
+        Source line of every move, lines only grow.
+    starts, ends : arrays of dtype int64, shape (m,)
+        Range [start, end) of dots of every move.
+    dots : slice
+        Return slice of dots of move.
+    move_of_dot, move_of_line : int
+        Return number of move by dot or by source line.
+    line_of_dot : int
+        Return source line, which gives dot.
+    dots_of_line : slice
+        Return slice of dots of source line (empty for lines without
+        moves).
+
+    Parameters
+    ----------
+    lines : array of dtype int, shape (n,)
+        Source line of every dot (Toolpath.lines).
+
+    Notes
+    -----
+    A move here is a run of dots of one source line, so chords of an arc
+    are one move. Index is built once in O(n), then every search is
+    O(log m) by np.searchsorted; arrays of dots or lines are searched at
+    once.
+    """
+    def __init__(self, lines):
+        lines = np.asarray(lines)
+        n = len(lines)
+        starts = np.flatnonzero(lines[1:] != lines[:-1]) + 1
+        self.starts = np.concatenate(([0], starts)).astype(np.int64) \
+            if n else np.zeros(0, dtype=np.int64)
+        self.ends = np.append(self.starts[1:], n).astype(np.int64)
+        self.lines = lines[self.starts].astype(np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def dots(self, move):
+        """ Return slice of dots of move """
+        return slice(int(self.starts[move]), int(self.ends[move]))
+
+    def move_of_dot(self, dot):
+        """ Return number of move, which contains dot """
+        return self.result(np.searchsorted(self.starts, dot, side='right')
+                           - 1)
+
+    def line_of_dot(self, dot):
+        """ Return source line of dot """
+        return self.result(self.lines[self.move_of_dot(dot)])
+
+    def move_of_line(self, line):
+        """
+        Return number of move of source line or of the first move after
+        it (the last move, if there are no moves after it)
+        """
+        move = np.searchsorted(self.lines, line, side='left')
+        return self.result(np.minimum(move, len(self) - 1))
+
+    def dots_of_line(self, line):
+        """ Return slice of dots of source line """
+        first, last = np.searchsorted(self.lines, [line, line + 1])
+        if first == last:
+            start = self.starts[first] if first < len(self) else \
+                self.ends[-1] if len(self) else 0
+            return slice(int(start), int(start))
+        return slice(int(self.starts[first]), int(self.ends[last - 1]))
+
+    @staticmethod
+    def result(value):
+        """ Return int for one value, array for arrays """
+        if np.ndim(value) == 0:
+            return int(value)
+        return value
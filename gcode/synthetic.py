@@ -0,0 +1,120 @@
+# synthetic.py
+#!/usr/bin/python
+"""
+Generator of big gcode files with structure of Slic3r output.
+
+Usage: python synthetic.py LINES FILE [--seed N]
+
+Every layer is a lift of nozzle and islands: travel to island, unretract,
+perimeter, infill zigzag, retract. Feedrates, fan and extrusion words
+are like in gcodes/altair.gcode, so files are parsed like real ones.
+The same lines and seed give the same file.
+"""
+import sys
+import math
+import random
+import argparse
+
+HEADER = """; synthetic
+; generated by synthetic.py, {lines} lines, seed {seed}
+
+G21 ; set units to millimeters
+M107
+M104 S200 ; set temperature
+G28 ; home all axes
+G1 Z5 F5000 ; lift nozzle
+
+M109 S200 ; wait for temperature to be reached
+G90 ; use absolute coordinates
+G92 E0
+M82 ; use absolute distances for extrusion
+G1 F1800.000 E-1.00000
+G92 E0
+"""
+LAYER_HEIGHT = 0.4
+LAYERS = 500   # big files have more islands in layer, not more layers
+LAYER_LINES = 100   # minimal number of lines of layer
+TRAVEL = 7800
+RETRACT = 1800
+PRINT_FEEDRATES = [600, 1260, 1800, 3000]
+
+
+def island(rnd):
+    """ Return lines of one island and extrusion at its end """
+    cx, cy = rnd.uniform(60, 140), rnd.uniform(40, 150)
+    r = rnd.uniform(2, 12)
+    n = rnd.randint(12, 60)
+    feed = rnd.choice(PRINT_FEEDRATES)
+    points = [(cx + r * math.cos(2 * math.pi * i / n),
+               cy + r * math.sin(2 * math.pi * i / n)) for i in range(n + 1)]
+    lines = ['G1 X{:.3f} Y{:.3f} F{:.3f}'.format(points[0][0], points[0][1],
+                                                  TRAVEL),
+             'G1 E1.00000 F{:.3f}'.format(RETRACT)]
+    e = 1.0
+    last = points[0]
+    for i, (x, y) in enumerate(points[1:]):
+        e += math.hypot(x - last[0], y - last[1]) * 0.0635
+        word = ' F{:.3f}'.format(feed) if i == 0 else ''
+        lines.append('G1 X{:.3f} Y{:.3f} E{:.5f}{}'.format(x, y, e, word))
+        last = (x, y)
+    if rnd.random() < 0.3:
+        lines.append('M106 S{}'.format(rnd.choice([97, 121, 191, 255])))
+    # infill: zigzag inside the square in the perimeter
+    side = r * 0.7
+    y = cy - side
+    step = rnd.uniform(0.5, 1.5)
+    right = True
+    lines.append('G1 X{:.3f} Y{:.3f} F{:.3f}'.format(cx - side, y, TRAVEL))
+    while y < cy + side:
+        x = cx + side if right else cx - side
+        e += 2 * side * 0.0635
+        lines.append('G1 X{:.3f} Y{:.3f} E{:.5f} F{:.3f}'.format(
+            x, y, e, feed))
+        y += step
+        e += step * 0.0635
+        lines.append('G1 X{:.3f} Y{:.3f} E{:.5f}'.format(x, y, e))
+        right = not right
+    lines.append('G1 F{:.3f} E{:.5f}'.format(RETRACT, e - 1))
+    lines.append('G92 E0')
+    return lines
+
+
+def generate(lines, fl, seed=0):
+    """
+    Write about {lines} lines of gcode to opened file.
+
+    Returns
+    -------
+    count : int
+        Number of written lines (layers are finished, so it may be a bit
+        more than lines).
+    """
+    rnd = random.Random(seed)
+    header = HEADER.format(lines=lines, seed=seed)
+    fl.write(header)
+    count = header.count('\n')
+    z = 0.5
+    per_layer = max(LAYER_LINES, lines // LAYERS)   # lines of one layer
+    while count < lines:
+        layer = ['G1 Z{:.3f} F{:.3f}'.format(z, TRAVEL)]
+        while len(layer) < per_layer:
+            layer.extend(island(rnd))
+        fl.write('\n'.join(layer) + '\n')
+        count += len(layer)
+        z += LAYER_HEIGHT
+    fl.write('M107\nM104 S0 ; turn off temperature\nG28 X0 ; home X axis\n'
+             'M84 ; disable motors\n')
+    return count + 4
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description='Generate Slic3r-like gcode.')
+    p.add_argument('lines', type=int, help='number of lines')
+    p.add_argument('file', help='output file, - for stdout')
+    p.add_argument('--seed', type=int, default=0)
+    args = p.parse_args()
+    if args.file == '-':
+        generate(args.lines, sys.stdout, args.seed)
+    else:
+        with open(args.file, 'w') as f:
+            generate(args.lines, f, args.seed)
@@ -0,0 +1,570 @@
+# tokenizer.py
+#!/usr/bin/python
+import re
+from itertools import islice
+from collections import namedtuple
+import numpy as np
+
+
+ASCII = getattr(re, 'ASCII', 0)   # \d and \s are ASCII only, like python 2
+# valid line: words (G1, X-1.5) and optional comment (; blah blah)
+LINE = re.compile(r'((?:[A-Z][+-]?\d+(?:\.\d+)?\s?)*)(\s*;\s.*)?$', ASCII)
+WORD = re.compile(r'([A-Z])([+-]?\d+(?:\.\d+)?)', ASCII)
+
+# columns of motions: X, Y, Z, F, line, G (0-3), I, J, R, mode (90/91),
+# E, extruder mode (82/83, 92 - E is set by G92)
+WIDTH = 12
+COLUMN = {'X': 0, 'Y': 1, 'Z': 2, 'F': 3, 'I': 6, 'J': 7, 'R': 8, 'E': 10}
+BLOCK_LINES = 65536   # lines of list, which are parsed at once
+BLOCK_SIZE = 2 * 1024 * 1024   # bytes of file, which are parsed at once
+
+# classes of bytes: lines are checked by pairs of neighbour classes,
+# END is the rest of line after code (whitespace and comment)
+OTHER, LETTER, SIGN, DIGIT, DOT, SPACE, NEWLINE, SEMICOLON, END = range(9)
+CLASSES = np.zeros(256, dtype=np.uint8)
+CLASSES[ord('A'):ord('Z')+1] = LETTER
+CLASSES[[ord('+'), ord('-')]] = SIGN
+CLASSES[ord('0'):ord('9')+1] = DIGIT
+CLASSES[ord('.')] = DOT
+CLASSES[[9, 11, 12, 13, 32]] = SPACE   # \s of LINE without \n
+CLASSES[10] = NEWLINE
+CLASSES[ord(';')] = SEMICOLON
+FOLLOWS = np.zeros(81, dtype=bool)   # class * 9 + class of the next byte
+FOLLOWS[[NEWLINE * 9 + LETTER, NEWLINE * 9 + NEWLINE, NEWLINE * 9 + END,
+         LETTER * 9 + SIGN, LETTER * 9 + DIGIT, SIGN * 9 + DIGIT,
+         DIGIT * 9 + DIGIT, DIGIT * 9 + DOT, DIGIT * 9 + SPACE,
+         DIGIT * 9 + LETTER, DIGIT * 9 + NEWLINE, DIGIT * 9 + END,
+         DOT * 9 + DIGIT, SPACE * 9 + LETTER, END * 9 + END,
+         END * 9 + NEWLINE]] = True
+PAIRS = np.zeros(65536, dtype=bool)   # FOLLOWS by 2 bytes (uint16)
+PAIRS[np.arange(81) // 9 + np.arange(81) % 9 * 256] = FOLLOWS
+POWERS = np.array([10 ** i for i in range(23)], dtype=float)   # exact
+COLUMNS = np.full(256, -1, dtype=np.int8)   # columns of motions by letter
+for letter, column in COLUMN.items():
+    COLUMNS[ord(letter)] = column
+del letter, column
+# integers of 8 digits at once
+ZEROS = np.uint64(0x3030303030303030)   # '00000000'
+DIGITS = np.uint64(0x0303030303030303)   # classes of 8 digits
+MASKS = np.array([(1 << 8 * i) - 1 for i in range(9)], dtype=np.uint64)
+SHIFTS = np.array([8 * (8 - i) % 64 for i in range(9)], dtype=np.uint64)
+INTEGERS = np.array([10 ** i for i in range(9)], dtype=np.uint64)
+
+
+class TokenizeError(ValueError):
+    """ Exception for line, which is not valid gcode """
+    def __init__(self, line, text):
+        ValueError.__init__(self, 'Invalid gcode in line {}: {!r}'.format(
+            line, text))
+        self.line = line
+        self.text = text
+
+
+class FileLines(object):
+    """
+    Lines of file (or of its part between byte offsets), which is read
+    again on every iteration
+    """
+    def __init__(self, path, begin=0, end=None):
+        self.path = path
+        self.begin = begin
+        self.end = end
+
+    def __iter__(self):
+        for data, count in self.blocks():
+            for line in data.decode('utf-8', 'replace').split('\n')[:count]:
+                yield line
+
+    def blocks(self, size=BLOCK_SIZE):
+        """ Yield (data, count): bytes of whole lines and their number """
+        with open(self.path, 'rb') as f:
+            f.seek(self.begin)
+            left = None if self.end is None else self.end - self.begin
+            while left is None or left > 0:
+                data = f.read(size if left is None else min(size, left))
+                if not data:
+                    break
+                if not data.endswith(b'\n'):
+                    data += f.readline()   # the last line is whole
+                if left is not None:
+                    left -= len(data)
+                yield data, data.count(b'\n') + (not data.endswith(b'\n'))
+
+
+class Word(namedtuple('Word', 'letter value line')):
+    """ One word of gcode: letter, numeric value and source line (from 0) """
+    __slots__ = ()
+
+
+class Block(object):
+    """
+    Words of block of lines, which are checked and found by arrays
+
+    Attributes
+    ----------
+    start, count : int
+        Number of the first line and number of lines.
+    positions : array of dtype int64, shape (k,)
+        Offset of letter of every word in data.
+    letters : array of dtype uint8, shape (k,)
+        Letter of every word (code of character).
+    lines : array of dtype int64, shape (k,)
+        Line of every word (from the first line of block).
+    begins, whole, fraction : arrays of dtype int64, shape (k,)
+        Offset of the first digit of every word, number of its digits
+        before dot and after dot.
+    numbers : array
+        Return values of words.
+    digits : array
+        Return number of digits of integers without sign (G1 - 1,
+        G01 - 2, G001 - 3), 0 for other values.
+    texts : list
+        Return source words by lines.
+    motions, coordinates : array
+        Return motions (like motions) and G1 moves (like coordinates).
+
+    Parameters
+    ----------
+    data : bytes
+        Lines, which are separated by b'\\n'.
+    start : int
+        Number of the first line.
+    count : int or None
+        Number of lines (a line after the last b'\\n' too).
+
+    Raises
+    ------
+    TokenizeError
+        If some line is not valid gcode (LINE doesn't match it).
+
+    Notes
+    -----
+    Every byte gets its class (letter, digit, space...), then comments
+    and whitespace at the ends of lines become END and every line is
+    valid, if every two neighbour bytes may follow each other (FOLLOWS)
+    and no number has two dots. Numbers of all words are converted at
+    once and only for words, which are used (see numbers), so there are
+    no Python objects per word.
+    """
+    def __init__(self, data, start=0, count=None):
+        n = len(data)
+        self.padded = np.zeros(n + 16, dtype=np.uint8)   # for windows
+        self.padded[:n] = np.frombuffer(data, dtype=np.uint8)
+        a = self.data = self.padded[:n]
+        self.start = start
+        self.newlines = np.flatnonzero(a == 10)
+        if count is None:
+            count = len(self.newlines) + int(len(a) > 0 and a[-1] != 10)
+        self.count = count
+        classes = np.empty(n + 16, dtype=np.uint8)   # END after data
+        classes[:n] = CLASSES[a]
+        classes[n:] = END
+        self.classes = classes
+        self.positions = np.zeros(0, dtype=np.int64)
+        if n:
+            self.check()
+        words = np.searchsorted(self.positions, self.newlines)   # before
+        self.lines = np.repeat(np.arange(len(words) + 1), np.diff(
+            np.concatenate(([0], words, [len(self.positions)]))))
+        self.letters = a[self.positions]
+        self.measure()
+
+    def bounds(self):
+        """ Return offsets of beginnings and ends of lines in data """
+        ends = np.append(self.newlines, len(self.data))[:self.count]
+        begins = np.concatenate(([0], self.newlines + 1))[:self.count]
+        return begins, ends
+
+    def check(self):
+        """ Mark the rest of lines after code as END, check classes """
+        classes = self.classes
+        begins, ends = self.bounds()
+        # line without trailing '\r' (like line.rstrip('\r\n'))
+        stop = ends.copy()
+        rows = np.arange(self.count)
+        while len(rows):
+            rows = rows[(stop[rows] > begins[rows]) &
+                        (self.data[stop[rows] - 1] == 13)]
+            stop[rows] -= 1
+
+        code = stop.copy()   # end of code of every line
+        errors = []
+        semicolons = np.flatnonzero(classes == SEMICOLON)
+        comment = np.zeros(self.count, dtype=bool)
+        if len(semicolons):
+            line = np.searchsorted(self.newlines, semicolons)
+            first = np.concatenate(([True], line[1:] != line[:-1]))
+            semicolons, line = semicolons[first], line[first]
+            bad = ~((semicolons + 1 < stop[line]) &
+                    (classes[semicolons + 1] == SPACE))
+            if bad.any():   # '; ' begins comment
+                errors.append(semicolons[bad][0])
+            comment[line] = True
+            code[line] = semicolons
+            rows = line
+            while len(rows):   # any whitespace before comment
+                rows = rows[(code[rows] > begins[rows]) &
+                            (classes[code[rows] - 1] == SPACE)]
+                code[rows] -= 1
+        # one whitespace after the last word
+        rows = np.flatnonzero(~comment & (stop - begins >= 2))
+        rows = rows[(classes[stop[rows] - 1] == SPACE) &
+                    (classes[stop[rows] - 2] == DIGIT)]
+        code[rows] -= 1
+
+        rows = np.flatnonzero(code < ends)
+        if len(rows):
+            sizes = ends[rows] - code[rows]
+            offsets = np.cumsum(sizes) - sizes
+            classes[np.repeat(code[rows] - offsets, sizes) +
+                    np.arange(sizes.sum())] = END
+
+        n = len(self.data)
+        if not FOLLOWS[NEWLINE * 9 + classes[0]]:
+            errors.append(0)
+        for first in (0, 1):   # pairs of bytes from even and odd offsets
+            pairs = np.ndarray(((n + 1 - first) // 2,), dtype='<u2',
+                               buffer=classes, offset=first, strides=(2,))
+            valid = PAIRS[pairs]   # the last byte is followed by END
+            if not valid.all():
+                errors.append(first + 2 * np.argmin(valid))
+        self.positions = np.flatnonzero(classes[:n] == LETTER)
+        if errors:
+            self.fail(int(np.searchsorted(self.newlines, min(errors))))
+
+    def fail(self, first):
+        """ Raise TokenizeError of the first invalid line from first """
+        begins, ends = self.bounds()
+        for n in range(first, self.count):
+            text = self.data[begins[n]:ends[n]].tobytes().decode(
+                'utf-8', 'replace').rstrip('\r\n')
+            if LINE.match(text) is None:
+                raise TokenizeError(self.start + n, text)
+        raise TokenizeError(self.start + first, '')   # never here
+
+    def measure(self):
+        """
+        Find digits of words (begins, whole, fraction).
+
+        Raises
+        ------
+        TokenizeError
+            If some number has two dots.
+        """
+        classes = self.classes
+        positions = self.positions
+        self.begins = positions + 1 + (classes[positions + 1] == SIGN)
+        self.whole = count_digits(classes, self.begins)
+        dot = self.begins + self.whole
+        self.fraction = np.where(classes[dot] == DOT,
+                                 count_digits(classes, dot + 1), 0)
+        twice = np.flatnonzero((self.fraction > 0) &
+                               (classes[dot + 1 + self.fraction] == DOT))
+        if len(twice):
+            self.fail(int(self.lines[twice[0]]))
+
+    def numbers(self, index):
+        """
+        Return values of words of index.
+
+        Digits before and after dot are read as integers by 8 bytes at
+        once, the number of all digits is exact up to 15 digits and it's
+        divided by power of 10, so values are the same as float() gives
+        (longer numbers are converted by float()).
+        """
+        a = self.padded
+        begins = self.begins[index]
+        whole, fraction = self.whole[index], self.fraction[index]
+        long = (whole > 7) | (fraction > 7) | (whole + fraction > 15)
+        short = np.where(long, 0, whole), np.where(long, 0, fraction)
+        values = (integers(windows(a, begins), short[0]) *
+                  INTEGERS[short[1]] +
+                  integers(windows(a, begins + whole + 1), short[1]))
+        values = values.astype(float) / POWERS[short[1]]
+        values[a[begins - 1] == ord('-')] *= -1
+        ends = self.ends(index)
+        for i in np.flatnonzero(long):
+            values[i] = float(a[self.positions[index][i] + 1:ends[i]]
+                              .tobytes())
+        return values
+
+    def digits(self, index):
+        """ Return digits of integers without sign of words (see Block) """
+        unsigned = self.begins[index] == self.positions[index] + 1
+        return np.where(unsigned & (self.fraction[index] == 0),
+                        np.minimum(self.whole[index], 3), 0)
+
+    def ends(self, index):
+        """ Return offsets of ends of words """
+        fraction = self.fraction[index]
+        return self.begins[index] + self.whole[index] + fraction + \
+            (fraction > 0)
+
+    def texts(self, index):
+        """ Return lists of source words of index by lines """
+        if not len(index):
+            return []
+        begins = self.positions[index]
+        sizes = self.ends(index) - begins + 1   # with separator
+        offsets = np.cumsum(sizes) - sizes
+        take = np.repeat(begins - offsets, sizes) + np.arange(sizes.sum())
+        text = self.data[np.minimum(take, len(self.data) - 1)]
+        text[offsets + sizes - 1] = ord(' ')
+        words = text[:-1].tobytes().decode('ascii').split(' ')
+        lines = self.lines[index]
+        ends = np.append(np.flatnonzero(lines[1:] != lines[:-1]) + 1,
+                         len(lines)).tolist()
+        return [words[i:j] for i, j in zip([0] + ends[:-1], ends)]
+
+    def motions(self):
+        """ Return array of motions of lines (see motions) """
+        n = self.count
+        table = np.full((n, WIDTH), np.nan)
+        table[:, 4] = self.start + np.arange(n)
+        letters, lines = self.letters, self.lines
+        values = self.numbers(slice(None))
+        column = COLUMNS[letters]
+        words = np.flatnonzero(column >= 0)
+        table[lines[words], column[words]] = values[words]
+        found = np.zeros(n, dtype=bool)
+        found[lines[words]] = True
+
+        g = np.flatnonzero(letters == ord('G'))
+        digits, value, line = self.digits(g), values[g], lines[g]
+        motion = (digits > 0) & (digits < 3) & (value <= 3)
+        table[line[motion], 5] = value[motion]
+        mode = (digits == 2) & ((value == 90) | (value == 91))
+        table[line[mode], 9] = value[mode]
+        reset = np.zeros(n, dtype=bool)
+        reset[line[(digits == 2) & (value == 92)]] = True
+        m = np.flatnonzero(letters == ord('M'))
+        digits, value, line = self.digits(m), values[m], lines[m]
+        extruder = (digits == 2) & ((value == 82) | (value == 83))
+        table[line[extruder], 11] = value[extruder]
+
+        known = ~np.isnan(table)
+        move = known[:, 5] & found
+        reset &= ~move & known[:, 10]
+        modes = ~move & ~reset & (known[:, 9] | known[:, 11])
+        # lines without motion give only modes (and E of G92)
+        table[np.flatnonzero(reset | modes)[:, None],
+              [0, 1, 2, 3, 5, 6, 7, 8]] = np.nan
+        table[modes, 10] = np.nan
+        table[reset, 11] = 92
+        return table[move | reset | modes]
+
+    def coordinate_words(self):
+        """ Return indexes of X, Y, Z, F words after G1 of lines """
+        letters = self.letters
+        g = np.flatnonzero(letters == ord('G'))
+        g = g[(self.digits(g) == 1) & (self.numbers(g) == 1)][::-1]
+        after = np.full(self.count, len(self.data))   # the first G1
+        after[self.lines[g]] = self.positions[g]
+        column = COLUMNS[letters]
+        return np.flatnonzero((column >= 0) & (column < 4) &
+                              (self.positions > after[self.lines]))
+
+    def coordinates(self):
+        """ Return array of G1 moves of lines (see coordinates) """
+        words = self.coordinate_words()
+        lines = self.lines[words]
+        table = np.full((self.count, 5), np.nan)
+        table[:, 4] = self.start + np.arange(self.count)
+        table[lines, COLUMNS[self.letters[words]]] = self.numbers(words)
+        return table[np.unique(lines)]
+
+
+def windows(array, offsets):
+    """ Return 8 bytes of array (uint8) from offsets as uint64 """
+    view = np.ndarray((len(array) - 7,), dtype='<u8', buffer=array,
+                      strides=(1,))
+    return view[offsets]
+
+
+def leading(windows):
+    """ Return number of digits at the beginning of windows of classes """
+    x = windows ^ DIGITS
+    lowest = x & (~x + np.uint64(1))   # bit of the first other byte
+    bit = (lowest.astype(np.float32).view(np.int32) >> 23) - 127   # exact
+    return np.where(x == 0, 8, bit >> 3)
+
+
+def count_digits(classes, offsets):
+    """ Return numbers of digits from offsets of classes """
+    count = leading(windows(classes, offsets))
+    for i in np.flatnonzero(count == 8):   # long numbers
+        while classes[offsets[i] + count[i]] == DIGIT:
+            count[i] += 1
+    return count
+
+
+def integers(windows, count):
+    """ Return integers of the first {count} (0-8) digits of windows """
+    x = ((windows - ZEROS) & MASKS[count]) << SHIFTS[count]
+    x = (x * np.uint64(10) + (x >> np.uint64(8))) & \
+        np.uint64(0x00ff00ff00ff00ff)
+    x = (x * np.uint64(100) + (x >> np.uint64(16))) & \
+        np.uint64(0x0000ffff0000ffff)
+    return (x * np.uint64(10000) + (x >> np.uint64(32))) & \
+        np.uint64(0xffffffff)
+
+
+def join(lines, count=BLOCK_LINES):
+    """ Yield (data, count): bytes of {count} lines and their number """
+    lines = iter(lines)
+    part = list(islice(lines, count))
+    while part:
+        data = '\n'.join(part)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        yield data, len(part)
+        part = list(islice(lines, count))
+
+
+def blocks(lines, start=0):
+    """
+    Generate Block of lines: FileLines are read by {BLOCK_SIZE} bytes,
+    lines of list (without '\\n') are joined by {BLOCK_LINES}
+    """
+    parts = lines.blocks() if isinstance(lines, FileLines) else join(lines)
+    for data, count in parts:
+        yield Block(data, start, count)
+        start += count
+
+
+def spans(line):
+    """
+    Split line into parts for highlighting.
+
+    Returns
+    -------
+    spans : list of tuples
+        (start, end, kind) of every word and of comment: kind is letter
+        of word or ';' for comment; None, if line is not valid gcode.
+    """
+    m = LINE.match(line.rstrip('\r\n'))
+    if m is None:
+        return None
+    result = [(w.start(), w.end(), w.group(1))
+              for w in WORD.finditer(m.group(1))]
+    if m.group(2):
+        result.append((m.start(2), m.end(2), ';'))
+    return result
+
+
+def scan(lines, start=0):
+    """
+    Read lines once, check them and drop comments.
+
+    Parameters
+    ----------
+    lines : iterable of strings
+        Gcode lines, e.g. list of blocks or opened file.
+    start : int
+        Number of first line.
+
+    Yields
+    ------
+    (line, code) : tuple
+        Number of line and its code without comment.
+        Lines without code are skipped.
+
+    Raises
+    ------
+    TokenizeError
+        If some line is not valid gcode.
+    """
+    line_match = LINE.match
+    for n, line in enumerate(lines, start):
+        line = line.rstrip('\r\n')
+        m = line_match(line)
+        if m is None:
+            raise TokenizeError(n, line)
+        code = m.group(1)
+        if code:
+            yield n, code
+
+
+def tokenize(lines, start=0):
+    """
+    Generate words from lines.
+
+    Yields
+    ------
+    word : Word
+        Letter, value (float) and number of line.
+    """
+    words = WORD.findall
+    for n, code in scan(lines, start):
+        for letter, value in words(code):
+            yield Word(letter, float(value), n)
+
+
+def coordinates(lines, start=0):
+    """
+    Generate coordinates of G1 moves from lines by blocks.
+
+    Only F, X, Y, Z after G1 are used, other words are ignored.
+
+    Parameters
+    ----------
+    lines : list of strings (without '\\n') or FileLines
+        Gcode lines.
+    start : int
+        Number of first line.
+
+    Yields
+    ------
+    moves : array of dtype float, shape (k, 5)
+        [X, Y, Z, Feedrate, line] of every move, missing values are NaN.
+        Lines without coordinates are skipped.
+    """
+    for block in blocks(lines, start):
+        yield block.coordinates()
+
+
+def coordinate_words(lines, start=0):
+    """
+    Generate source words of coordinates of G1 moves by blocks.
+
+    Yields
+    ------
+    words : list of lists of strings
+        X, Y, Z, F words (as they are in text) of every move.
+    """
+    for block in blocks(lines, start):
+        yield block.texts(block.coordinate_words())
+
+
+def motions(lines, start=0):
+    """
+    Generate motions (G0, G1, G2, G3) and modes (G90, G91, M82, M83, G92 E)
+    by blocks of lines.
+
+    Lines are parsed separately, modal state isn't kept here, so any
+    part of file can be parsed alone: mode of every motion is found by
+    gcode.fill_moves.
+
+    Parameters
+    ----------
+    lines : list of strings (without '\\n') or FileLines
+        Gcode lines.
+    start : int
+        Number of first line.
+
+    Yields
+    ------
+    motions : array of dtype float, shape (k, WIDTH)
+        [X, Y, Z, Feedrate, line, G, I, J, R, mode, E, extruder] of
+        every motion, missing values are NaN. G is NaN for lines, which
+        only change mode; mode and extruder are NaN, if line doesn't
+        change them. G92 gives extruder 92 and new E. Motions without
+        coordinates are skipped.
+
+    Raises
+    ------
+    TokenizeError
+        If some line is not valid gcode.
+    """
+    for block in blocks(lines, start):
+        yield block.motions()
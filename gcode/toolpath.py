@@ -0,0 +1,235 @@
+# toolpath.py
+#!/usr/bin/python
+import struct
+import numpy as np
+import lod
+import instrument
+from layers import Layers
+from sourcemap import SourceMap
+
+
+# File of toolpath (little-endian): header, layer index, positions,
+# colors, feedrates, lines, levels of detail. Sections begin on ALIGN
+# bytes, so they can be mapped to arrays without copy.
+MAGIC = b'GCTP'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sHHQQQQ3f4x7Q3d')   # see Toolpath.save
+HEADER_SIZE = 192
+ALIGN = 64
+LAYER = np.dtype([('z', '<f8'), ('start', '<i8'), ('end', '<i8'),
+                  ('first_line', '<i8'), ('last_line', '<i8')])
+LEVEL = np.dtype([('tolerance', '<f8'), ('start', '<i8'), ('end', '<i8')])
+
+
+class Toolpath(object):
+    """
+    Class for parsed toolpath: dots to draw and moves, which give them
+
+    Attributes
+    ----------
+    positions : array of dtype float32, shape (n, 3)
+        x, y, z of every dot.
+    colors : array of dtype float32, shape (n, 4)
+        r, g, b, p of every dot.
+    lines : array of dtype int32, shape (n,)
+        Source line of every dot.
+    feedrates : array of dtype float32, shape (m,)
+        Feedrate of every move.
+    offset : array of dtype float32, shape (3,)
+        Translation of positions, which is applied on drawing.
+    origin : array of dtype float, shape (3,)
+        Minimal X, Y, Z of source, which are subtracted from positions
+        (source coordinates are positions + origin).
+    layers : layers.Layers
+        Index of layers, it's built on the first use.
+    levels : list
+        Levels of detail (see lod.levels) of big toolpath, they are built
+        on the first use (in background, before toolpath is shown).
+    sourcemap : sourcemap.SourceMap
+        Index of moves: source line and dots of every move, it's built on
+        the first use.
+    layer : Toolpath
+        Return dots of layers [first, last].
+    save : None
+        Save toolpath to binary file.
+    load : Toolpath
+        Read toolpath from binary file (mapped to memory).
+
+    Notes
+    -----
+    Slices of toolpath share memory with it, so they cost nothing.
+    """
+    def __init__(self, positions, colors, lines, feedrates=None,
+                 offset=(0, 0, 0), origin=(0, 0, 0)):
+        self.positions = np.asarray(positions, dtype=np.float32)
+        self.colors = np.asarray(colors, dtype=np.float32)
+        self.lines = np.asarray(lines, dtype=np.int32)
+        if feedrates is None:
+            feedrates = []
+        self.feedrates = np.asarray(feedrates, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.origin = np.asarray(origin, dtype=float)
+        self._layers = None
+        self._levels = None
+        self._sourcemap = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        """ Return toolpath with slice of dots (views, not copies) """
+        if not isinstance(index, slice):
+            raise TypeError('Toolpath supports only slices')
+        return Toolpath(self.positions[index], self.colors[index],
+                        self.lines[index], self.feedrates, self.offset,
+                        self.origin)
+
+    @property
+    def layers(self):
+        """ Return index of layers (it's built once) """
+        if self._layers is None:
+            self._layers = Layers(self.positions, self.lines,
+                                  self.origin[2])
+        return self._layers
+
+    @property
+    def levels(self):
+        """ Return levels of detail, [] for small toolpath (built once) """
+        if self._levels is None and len(self) <= lod.MIN_DOTS:
+            self._levels = []
+        elif self._levels is None:
+            with instrument.stage('decimate') as stage:
+                self._levels = lod.levels(self.positions)
+                stage.points = sum(len(index)
+                                   for tolerance, index in self._levels[1:])
+        return self._levels
+
+    @property
+    def sourcemap(self):
+        """ Return index of moves and source lines (it's built once) """
+        if self._sourcemap is None:
+            self._sourcemap = SourceMap(self.lines)
+        return self._sourcemap
+
+    def layer(self, first, last=None):
+        """ Return toolpath with dots of layers [first, last] (views) """
+        return self[self.layers.dots(first, last)]
+
+    def translate(self, offset):
+        """ Return the same dots with other offset (without copy) """
+        toolpath = Toolpath(self.positions, self.colors, self.lines,
+                            self.feedrates, self.offset + offset,
+                            self.origin)
+        toolpath._layers = self._layers
+        toolpath._levels = self._levels
+        return toolpath
+
+    def transformed(self):
+        """ Return copy of positions with offset applied """
+        return self.positions + self.offset
+
+    def save(self, fl):
+        """
+        Save toolpath to binary file.
+
+        Header: magic, format version, flags, numbers of dots, feedrates,
+        layers and levels of detail, offset (3 float32), offsets of seven
+        sections in file: layer index, positions (float32, n*3), colors
+        (float32, n*4), feedrates (float32, m), lines (int32, n), level
+        index (tolerance, range of dots) and dots of levels (int32), then
+        origin (3 float64). Levels of detail are built here, if they
+        aren't yet, the first level (all dots) isn't saved.
+        """
+        layers = self.layers
+        index = np.zeros(len(layers), dtype=LAYER)
+        index['z'] = layers.z
+        index['start'] = layers.starts
+        index['end'] = layers.ends
+        index['first_line'] = layers.first_lines
+        index['last_line'] = layers.last_lines
+        levels = self.levels[1:]
+        level_index = np.zeros(len(levels), dtype=LEVEL)
+        sizes = [len(dots) for tolerance, dots in levels]
+        level_index['tolerance'] = [tolerance for tolerance, dots in levels]
+        level_index['end'] = np.cumsum(sizes)
+        level_index['start'] = level_index['end'] - sizes
+        level_dots = np.concatenate([dots for tolerance, dots in levels] +
+                                    [np.zeros(0, dtype=np.int64)])
+        sections = [index, self.positions.astype('<f4'),
+                    self.colors.astype('<f4'), self.feedrates.astype('<f4'),
+                    self.lines.astype('<i4'), level_index,
+                    level_dots.astype('<i4')]
+        offsets = []
+        position = HEADER_SIZE
+        for array in sections:
+            position += -position % ALIGN
+            offsets.append(position)
+            position += array.nbytes
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(self),
+                             len(self.feedrates), len(layers), len(levels),
+                             *(list(self.offset) + offsets +
+                               list(self.origin)))
+        with open(fl, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b'\0'))
+            for offset, array in zip(offsets, sections):
+                if array.nbytes:   # file ends with data, not padding
+                    f.write(b'\0' * (offset - f.tell()))
+                    f.write(np.ascontiguousarray(array).tobytes())
+
+    @classmethod
+    def load(cls, fl, mmap=True):
+        """
+        Read toolpath from file, which save writes.
+
+        Arrays are mapped to file (read only), if mmap is True, so only
+        used pages are read.
+
+        Raises
+        ------
+        ValueError
+            If file isn't a toolpath file or its version is unknown.
+        """
+        with open(fl, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+        if len(head) < HEADER.size or head[:4] != MAGIC:
+            raise ValueError('Not a toolpath file: {}'.format(fl))
+        fields = HEADER.unpack(head[:HEADER.size])
+        version, flags, n, m, k, l = fields[1:7]
+        offset = fields[7:10]
+        offsets = fields[10:17]
+        origin = fields[17:]
+        if version != FORMAT_VERSION:
+            raise ValueError('Unknown version of toolpath file: {}'.format(
+                version))
+        if mmap:
+            data = np.memmap(fl, dtype=np.uint8, mode='r')
+        else:
+            data = np.fromfile(fl, dtype=np.uint8)
+
+        def section(i, dtype, count, width=None):
+            size = np.dtype(dtype).itemsize * count * (width or 1)
+            array = data[offsets[i]:offsets[i] + size].view(dtype)
+            if len(array) != count * (width or 1):
+                raise ValueError('Truncated toolpath file: {}'.format(fl))
+            return array.reshape(count, width) if width else array
+
+        index = section(0, LAYER, k)
+        toolpath = cls(section(1, '<f4', n, 3), section(2, '<f4', n, 4),
+                       section(4, '<i4', n), section(3, '<f4', m), offset,
+                       origin)
+        toolpath._layers = Layers.from_index(
+            index['z'], index['start'], index['end'], index['first_line'],
+            index['last_line'])
+        level_index = section(5, LEVEL, l)
+        level_dots = section(6, '<i4', int(level_index['end'][-1]) if l
+                             else 0)
+        toolpath._levels = [(0., np.arange(n))] if l else []
+        for tolerance, start, end in level_index.tolist():
+            toolpath._levels.append((tolerance, level_dots[start:end]))
+        return toolpath
+
+    @property
+    def nbytes(self):
+        """ Return memory size of arrays """
+        return (self.positions.nbytes + self.colors.nbytes +
+                self.lines.nbytes + self.feedrates.nbytes)
@@ -0,0 +1,164 @@
+# validator.py
+#!/usr/bin/python
+"""
+Validator of gcode, which finds every invalid line.
+
+Text is checked by blocks of lines with one compiled scanner, so valid
+lines don't cost Python code: the scanner stops only on invalid lines,
+which are explained by a small state machine (column and reason).
+Lines are the same as tokenizer.LINE accepts.
+"""
+import re
+from collections import namedtuple
+
+try:   # possessive quantifiers (python 3.11+) never backtrack
+    BLOCK = re.compile(r'(?:(?:[A-Z][+-]?\d++(?:\.\d++)?[^\S\n]?)*+'
+                       r'(?:[^\S\n]*+;(?!\r*+(?:\n|\Z))[^\S\n][^\n]*+)?'
+                       r'\r*+(?:\n|\Z))*+', getattr(re, 'ASCII', 0))
+except re.error:
+    BLOCK = None   # lines are checked one by one
+import tokenizer
+
+LIMIT = 100   # diagnostics by default
+CHUNK_SIZE = 8 * 1024 * 1024   # characters of file in one block
+DIGITS = frozenset('0123456789')   # ASCII only, like tokenizer
+SPACES = frozenset(' \t\r\x0b\x0c')
+
+
+class Diagnostic(namedtuple('Diagnostic', 'line column reason')):
+    """ Error in gcode: line and column (from 0) and reason """
+    __slots__ = ()
+
+    def __str__(self):
+        return 'line {}, column {}: {}'.format(self.line + 1,
+                                               self.column + 1, self.reason)
+
+
+def explain(line):
+    """
+    Return (column, reason) of the first error in line or None.
+
+    It's the same grammar as tokenizer.LINE: words (letter, optional
+    sign, digits, optional fraction) with at most one space between
+    them, then optional comment, which begins with '; '.
+    """
+    line = line.rstrip('\r\n')
+    n = len(line)
+    i = 0
+    while i < n and 'A' <= line[i] <= 'Z':
+        letter = line[i]
+        i += 1
+        if i < n and line[i] in '+-':
+            i += 1
+        if i == n or line[i] not in DIGITS:
+            return i, 'number expected after {}'.format(letter)
+        while i < n and line[i] in DIGITS:
+            i += 1
+        if i < n and line[i] == '.':
+            i += 1
+            if i == n or line[i] not in DIGITS:
+                return i, "digits expected after '.'"
+            while i < n and line[i] in DIGITS:
+                i += 1
+        if i < n and line[i] in SPACES:
+            if i + 1 == n:
+                return None
+            if 'A' <= line[i+1] <= 'Z':
+                i += 1
+    if i == n:
+        return None
+    # only comment may be here, after any whitespace
+    k = i
+    while k < n and line[k] in SPACES:
+        k += 1
+    if k == n:
+        return i, 'whitespace at the end of line'
+    ch = line[k]
+    if ch == ';':
+        if k + 1 < n and line[k+1] in SPACES:
+            return None
+        return k, "space expected after ';'"
+    if k > i and 'A' <= ch <= 'Z':
+        return i, 'more than one space between words'
+    if ch in DIGITS:
+        return k, 'number without letter'
+    if ch.islower():
+        return k, 'lowercase letter {!r}'.format(ch)
+    return k, 'unexpected character {!r}'.format(ch)
+
+
+def check_text(text, start=0, limit=LIMIT):
+    """
+    Return diagnostics of lines of text.
+
+    Parameters
+    ----------
+    text : string
+        Lines, which are separated by '\\n'.
+    start : int
+        Number of the first line.
+    limit : int or None
+        Maximal number of diagnostics (None - all of them).
+    """
+    result = []
+    if BLOCK is None:
+        return check_lines(text.split('\n'), start, limit)
+    pos = 0
+    line = start
+    end = len(text)
+    while pos < end:
+        bad = BLOCK.match(text, pos).end()
+        if bad == end:
+            break
+        line += text.count('\n', pos, bad)
+        stop = text.find('\n', bad)
+        if stop < 0:
+            stop = end
+        found = explain(text[bad:stop])
+        column, reason = found or (0, 'invalid gcode')
+        result.append(Diagnostic(line, column, reason))
+        if limit is not None and len(result) >= limit:
+            break
+        pos = stop + 1
+        line += 1
+    return result
+
+
+def check_lines(lines, start=0, limit=LIMIT):
+    """ Return diagnostics of iterable of lines (one by one) """
+    result = []
+    match = tokenizer.LINE.match
+    for n, line in enumerate(lines, start):
+        line = line.rstrip('\r\n')
+        if match(line) is None:
+            column, reason = explain(line) or (0, 'invalid gcode')
+            result.append(Diagnostic(n, column, reason))
+            if limit is not None and len(result) >= limit:
+                break
+    return result
+
+
+def check_file(path, limit=LIMIT, size=CHUNK_SIZE):
+    """
+    Return diagnostics of file, which is read by blocks of lines
+
+    Lines are the ones of tokenizer.FileLines: bytes are decoded as UTF-8
+    (invalid ones are replaced), only '\n' ends line.
+    """
+    result = []
+    line = 0
+    for data, count in tokenizer.FileLines(path).blocks(size):
+        left = None if limit is None else limit - len(result)
+        result.extend(check_text(data.decode('utf-8', 'replace'), line,
+                                 left))
+        if limit is not None and len(result) >= limit:
+            break
+        line += count
+    return result
+
+
+def check(blocks, limit=LIMIT):
+    """ Return diagnostics of list of lines or tokenizer.FileLines """
+    if isinstance(blocks, tokenizer.FileLines):
+        return check_file(blocks.path, limit)
+    return check_text('\n'.join(blocks), 0, limit)